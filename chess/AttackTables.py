@@ -0,0 +1,46 @@
+"""
+Lookup tables for move generation and attack detection, built once at import time. Squares are numbered
+row * 8 + col and every table maps a square to the (row, col) squares a piece there reaches, so the generators loop
+over them without bounds checks and without building new tuples.
+"""
+
+SQUARE_COORDINATES = [(r, c) for r in range(8) for c in range(8)]  # square -> (row, col), shared by all the tables
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+# directions are (dRow, dCol), the first four are orthogonal and the last four are diagonal
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+def _leaperSquares(offsets):
+    return [tuple(SQUARE_COORDINATES[(r + dr) * 8 + c + dc] for dr, dc in offsets
+                  if 0 <= r + dr < 8 and 0 <= c + dc < 8) for r, c in SQUARE_COORDINATES]
+
+
+def _raySquares():
+    rays = []
+    for r, c in SQUARE_COORDINATES:
+        squareRays = []
+        for dr, dc in DIRECTIONS:
+            ray = []
+            endRow, endCol = r + dr, c + dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                ray.append(SQUARE_COORDINATES[endRow * 8 + endCol])
+                endRow += dr
+                endCol += dc
+            squareRays.append(tuple(ray))
+        rays.append(tuple(squareRays))
+    return rays
+
+
+KNIGHT_SQUARES = _leaperSquares(KNIGHT_OFFSETS)
+KING_SQUARES = _leaperSquares(KING_OFFSETS)
+# squares attacked by a pawn of the color standing on the square
+PAWN_ATTACK_SQUARES = {"w": _leaperSquares(((-1, -1), (-1, 1))), "b": _leaperSquares(((1, -1), (1, 1)))}
+# squares a pawn of the color attacks the square from
+PAWN_ATTACKER_SQUARES = {"w": PAWN_ATTACK_SQUARES["b"], "b": PAWN_ATTACK_SQUARES["w"]}
+# RAY_SQUARES[square][direction] are the squares along the direction, nearest first
+RAY_SQUARES = _raySquares()
@@ -3,33 +3,176 @@ This class is responsible for storing all the information about the current stat
 determining the valid moves at the current state. It will also keep a move log.
 """
 
+import random
+
+from AttackTables import BISHOP_DIRECTIONS, DIRECTIONS, KING_SQUARES, KNIGHT_SQUARES, PAWN_ATTACK_SQUARES, \
+    PAWN_ATTACKER_SQUARES, QUEEN_DIRECTIONS, RAY_SQUARES, ROOK_DIRECTIONS, SQUARE_COORDINATES
+from Evaluation import pieceScore, pieceSquareScores
+
+# Zobrist keys, seeded so every process (GUI, search workers) builds exactly the same keys
+DEBUG_ZOBRIST = False  # set to True to check the incremental key against a full recompute after every move
+DEBUG_EVAL = False  # set to True to check the running material and position scores the same way
+zobristRandom = random.Random(20231017)
+ZOBRIST_PIECES = {color + piece: [zobristRandom.getrandbits(64) for _ in range(64)]
+                  for color in "wb" for piece in "pNBRQK"}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [zobristRandom.getrandbits(64) for _ in range(16)]  # indexed by the castling rights
+ZOBRIST_EN_PASSANT = [zobristRandom.getrandbits(64) for _ in range(8)]  # indexed by the file of the square
+
+# castling rights are packed in 4 bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+FEN_CASTLING = {"K": WHITE_KINGSIDE, "Q": WHITE_QUEENSIDE, "k": BLACK_KINGSIDE, "q": BLACK_QUEENSIDE}
+# rights that are kept when a piece moves from or to a square (row * 8 + col): moving the king or a rook, or
+# capturing a rook, loses the rights that go with it
+CASTLING_KEPT = [15] * 64
+CASTLING_KEPT[0] = 15 & ~BLACK_QUEENSIDE
+CASTLING_KEPT[4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_KEPT[7] = 15 & ~BLACK_KINGSIDE
+CASTLING_KEPT[56] = 15 & ~WHITE_QUEENSIDE
+CASTLING_KEPT[60] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_KEPT[63] = 15 & ~WHITE_KINGSIDE
+# piece a square of CASTLING_KEPT must hold for the rights it takes away to be kept
+CASTLING_HOME_PIECES = {0: "bR", 4: "bK", 7: "bR", 56: "wR", 60: "wK", 63: "wR"}
+UNDO_STACK_SIZE = 256  # undo records allocated up front, the stack grows for longer games
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+# FEN letter to board piece and back
+FEN_PIECES = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+              "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+PIECE_FEN_LETTERS = {piece: letter for letter, piece in FEN_PIECES.items()}
+# an empty square for every digit of a FEN rank
+FEN_EMPTY_SQUARES = {str(n): ["--"] * n for n in range(1, 9)}
+
+# a moveID packs a move in 16 bits: start square (row * 8 + col) in bits 0-5, end square in bits 6-11 and these flags
+# in bits 12-15, a promotion also has the index of its piece in Move.promotionPieces in the two low flag bits.
+# The generators and makeMove still work on Move objects, also inside the search. Only stored moves are moveIDs: the
+# transposition table, the killers, the principal variation and the engine worker protocol, a stored move is turned
+# back into a Move with getMoveFromID.
+DOUBLE_PUSH_FLAG = 1
+CASTLE_FLAG = 2
+CAPTURE_FLAG = 4
+EN_PASSANT_FLAG = 5  # the capture flag is set too
+PROMOTION_FLAG = 8
+
+
+class UndoRecord:
+    """
+    What makeMove can't work out backwards from the move: the state of the position before the move
+    """
+    __slots__ = ("castlingRights", "enPassantPossible", "halfmoveClock", "zobristKey", "whiteMaterial",
+                 "blackMaterial", "whitePosition", "blackPosition")
 
-class GameState:
 
-    def __init__(self):
-        """This is a 8x8 2d list. Each element of the list has 2 characters, first character represent the color of
-        the piece "b" or "w", and the second character represent the type of the piece "K","N","Q", "R", "B", "p"
-        and "--" represent the empty spaces."""
-        self.board = [
-            ["bR", 'bN', "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", 'wN', "wB", "wQ", "wK", "wB", "wN", "wR"]
-        ]
+class GameState:
+    # tables the running scores are kept with, setEvaluation gives a game state tables of its own
+    pieceScore = pieceScore
+    pieceSquareScores = pieceSquareScores
+
+    def __init__(self, fen=START_FEN):
+        """self.board is a 8x8 2d list. Each element of the list has 2 characters, first character represent the color
+        of the piece "b" or "w", and the second character represent the type of the piece "K","N","Q", "R", "B", "p"
+        and "--" represent the empty spaces. The game starts from the position given by the FEN string."""
         self.moveFunctions = {'p': self.getPawnMoves,
                               'R': self.getRockMoves,
                               'N': self.getKnightMoves,
                               'B': self.getBishopMoves,
                               'Q': self.getQueenMoves,
                               'K': self.getKingMoves}
-        self.whiteToMove = True
+        # pseudo legal move generators used by generatePseudoLegalMoves
+        self.moveGenerators = {'p': self.generatePawnMoves,
+                               'R': self.generateRookMoves,
+                               'N': self.generateKnightMoves,
+                               'B': self.generateBishopMoves,
+                               'Q': self.generateQueenMoves,
+                               'K': self.generateKingMoves}
+        # undo record of the move moveLog[i] is undoStack[i], the records are reused so making a move allocates none
+        self.undoStack = [UndoRecord() for _ in range(UNDO_STACK_SIZE)]
+        self.loadFen(fen)
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        A new game state set up from a FEN string
+        """
+        return cls(fen)
+
+    def loadFen(self, fen):
+        """
+        Reset the game to the position of a FEN string, the move log is cleared. Reusing one game state this way is
+        the fastest way to go through many positions. A malformed FEN raises ValueError and leaves the game state as
+        it was.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        placement, side, castling, enPassant = fields[:4]
+        board = []
+        # the Zobrist key and the scores are summed up while the pieces are placed instead of in a second pass
+        key = 0
+        materialScore = {"w": 0, "b": 0}
+        positionScore = {"w": 0, "b": 0}
+        kingLocations = {"wK": [], "bK": []}
+        pieceScore, pieceSquareScores = self.pieceScore, self.pieceSquareScores
+        for r, rankText in enumerate(placement.split("/")):
+            row = []
+            c = 0
+            for char in rankText:
+                piece = FEN_PIECES.get(char)
+                if piece is None:
+                    emptySquares = FEN_EMPTY_SQUARES.get(char)
+                    if emptySquares is None:
+                        raise ValueError("Invalid piece %r in FEN: %s" % (char, fen))
+                    row += emptySquares
+                    c += len(emptySquares)
+                else:
+                    if c >= 8 or r >= 8:
+                        raise ValueError("Too many squares in FEN: " + fen)
+                    sq = r * 8 + c
+                    key ^= ZOBRIST_PIECES[piece][sq]
+                    materialScore[piece[0]] += pieceScore[piece[1]]
+                    positionScore[piece[0]] += pieceSquareScores[piece][sq]
+                    if piece[1] == "K":
+                        kingLocations[piece].append((r, c))
+                    row.append(piece)
+                    c += 1
+            if c != 8:
+                raise ValueError("Rank %d of the FEN does not have 8 squares: %s" % (8 - r, fen))
+            board.append(row)
+        if len(board) != 8:
+            raise ValueError("FEN board does not have 8 ranks: " + fen)
+        if side not in ("w", "b"):
+            raise ValueError("Invalid side to move in FEN: " + fen)
+        if len(kingLocations["wK"]) != 1 or len(kingLocations["bK"]) != 1:
+            raise ValueError("FEN needs exactly one king of each color: " + fen)
+        if enPassant == "-":
+            enPassantPossible = ()
+        elif len(enPassant) == 2 and enPassant[0] in Move.filesToCols and enPassant[1] == ("6" if side == "w" else "3"):
+            enPassantPossible = (Move.ranksToRows[enPassant[1]], Move.filesToCols[enPassant[0]])
+        else:
+            raise ValueError("Invalid en passant square in FEN: " + fen)
+        castlingRights = 0
+        for char in castling.replace("-", ""):
+            if char not in FEN_CASTLING:
+                raise ValueError("Invalid castling rights in FEN: " + fen)
+            castlingRights |= FEN_CASTLING[char]
+        # a right is only kept while its king and rook are on their home squares, the move generator counts on it
+        for sq, piece in CASTLING_HOME_PIECES.items():
+            if board[sq // 8][sq % 8] != piece:
+                castlingRights &= CASTLING_KEPT[sq]
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("Invalid move counters in FEN: " + fen) from None
+        self.board = board
+        self.whiteKingLocation = kingLocations["wK"][0]
+        self.blackKingLocation = kingLocations["bK"][0]
+        self.whiteToMove = side == "w"
+        self.startFen = fen  # the position moveLog starts from
         self.moveLog = []
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
 
         self.checkmate = False
         self.stalemate = False
@@ -38,30 +181,177 @@ class GameState:
         self.checks = []
         self.inCheck = False
 
-        self.enPassantPossible = ()  # coordinates for the square where en passant capture is possible
-        self.enPassantPossibleLog = [self.enPassantPossible]
-
-        self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        # coordinates for the square where en passant capture is possible
+        self.enPassantPossible = enPassantPossible
+        self.castlingRights = castlingRights
+
+        # plies since the last capture or pawn move, and the number of the move being played
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRights]
+        if self.enPassantPossible != ():
+            key ^= ZOBRIST_EN_PASSANT[self.enPassantPossible[1]]
+        self.zobristKey = key
+        # running score of each side: material in pieceScore units, position in pieceSquareScores units
+        self.materialScore = materialScore
+        self.positionScore = positionScore
+
+    def to_fen(self):
+        """
+        FEN string of the current position
+        """
+        ranks = []
+        for row in self.board:
+            rankText = ""
+            emptySquares = 0
+            for piece in row:
+                if piece == "--":
+                    emptySquares += 1
+                else:
+                    if emptySquares:
+                        rankText += str(emptySquares)
+                        emptySquares = 0
+                    rankText += PIECE_FEN_LETTERS[piece]
+            if emptySquares:
+                rankText += str(emptySquares)
+            ranks.append(rankText)
+        castling = "".join(char for char, right in FEN_CASTLING.items() if self.castlingRights & right)
+        enPassant = "-" if self.enPassantPossible == () else \
+            Move.colsToFiles[self.enPassantPossible[1]] + Move.rowsToRanks[self.enPassantPossible[0]]
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", enPassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
+
+    def computeZobristKey(self):
+        """
+        Compute the Zobrist key of the position from scratch, makeMove and undoMove keep it up to date incrementally
+        """
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][r * 8 + c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_CASTLING[self.castlingRights]
+        if self.enPassantPossible != ():
+            key ^= ZOBRIST_EN_PASSANT[self.enPassantPossible[1]]
+        return key
+
+    def toggleMoveInZobristKey(self, move, placedPiece, enPassantBefore, enPassantAfter, rightsBefore, rightsAfter):
+        """
+        XOR a move into the Zobrist key (doing it twice with the same arguments takes it out again), the rights are the
+        castling rights masks
+        """
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow * 8 + move.startCol]
+        key ^= ZOBRIST_PIECES[placedPiece][move.endRow * 8 + move.endCol]
+        if move.enPassant:
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.startRow * 8 + move.endCol]
+        elif move.isCapture:
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow * 8 + move.endCol]
+        if move.castle:
+            rookKeys = ZOBRIST_PIECES[move.pieceMoved[0] + "R"]
+            if move.endCol - move.startCol == 2:  # kingside
+                key ^= rookKeys[move.endRow * 8 + move.endCol + 1] ^ rookKeys[move.endRow * 8 + move.endCol - 1]
+            else:  # queenside
+                key ^= rookKeys[move.endRow * 8 + move.endCol - 2] ^ rookKeys[move.endRow * 8 + move.endCol + 1]
+        if enPassantBefore != ():
+            key ^= ZOBRIST_EN_PASSANT[enPassantBefore[1]]
+        if enPassantAfter != ():
+            key ^= ZOBRIST_EN_PASSANT[enPassantAfter[1]]
+        self.zobristKey = key ^ ZOBRIST_CASTLING[rightsBefore] ^ ZOBRIST_CASTLING[rightsAfter]
+
+    def computeScores(self):
+        """
+        Compute the material and the position score of both sides from scratch
+        """
+        materialScore = {"w": 0, "b": 0}
+        positionScore = {"w": 0, "b": 0}
+        pieceScore, pieceSquareScores = self.pieceScore, self.pieceSquareScores
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    materialScore[piece[0]] += pieceScore[piece[1]]
+                    positionScore[piece[0]] += pieceSquareScores[piece][r * 8 + c]
+        return materialScore, positionScore
+
+    def setEvaluation(self, pieceScore, pieceSquareScores):
+        """
+        Keep the running scores with other tables (see Evaluation.buildPieceSquareScores), so engines with different
+        evaluations can play each other. The moves already made are taken back and made again, so their undo records
+        hold scores of the new tables too.
+        """
+        moves = self.moveLog[:]
+        for _ in moves:
+            self.undoMove()
+        self.pieceScore = pieceScore
+        self.pieceSquareScores = pieceSquareScores
+        self.materialScore, self.positionScore = self.computeScores()
+        for move in moves:
+            self.makeMove(move)
+
+    def updateScores(self, move, placedPiece, sign):
+        """
+        Add (sign 1) or take back (sign -1) the score changes of a move, undoMove restores the saved scores instead
+        """
+        pieceScore, pieceSquareScores = self.pieceScore, self.pieceSquareScores
+        color = move.pieceMoved[0]
+        endSq = move.endRow * 8 + move.endCol
+        positionDelta = pieceSquareScores[placedPiece][endSq] - \
+            pieceSquareScores[move.pieceMoved][move.startRow * 8 + move.startCol]
+        if move.castle:
+            rookScores = pieceSquareScores[color + "R"]
+            if move.endCol - move.startCol == 2:  # kingside
+                positionDelta += rookScores[endSq - 1] - rookScores[endSq + 1]
+            else:  # queenside
+                positionDelta += rookScores[endSq + 1] - rookScores[endSq - 2]
+        self.positionScore[color] += sign * positionDelta
+        if move.pawnPromotion:
+            self.materialScore[color] += sign * (pieceScore[placedPiece[1]] - pieceScore["p"])
+        if move.isCapture:
+            capturedSq = move.startRow * 8 + move.endCol if move.enPassant else endSq
+            enemyColor = move.pieceCaptured[0]
+            self.materialScore[enemyColor] -= sign * pieceScore[move.pieceCaptured[1]]
+            self.positionScore[enemyColor] -= sign * pieceSquareScores[move.pieceCaptured][capturedSq]
 
     def makeMove(self, move):
         """
         Takes a move as a parameter and executes it(this will not work for castling, pawn promotion and en-passant)
         """
+        # save what undoMove can't work out from the move
+        ply = len(self.moveLog)
+        if ply == len(self.undoStack):
+            self.undoStack.append(UndoRecord())
+        record = self.undoStack[ply]
+        record.castlingRights = rightsBefore = self.castlingRights
+        record.enPassantPossible = enPassantBefore = self.enPassantPossible
+        record.halfmoveClock = self.halfmoveClock
+        record.zobristKey = self.zobristKey
+        record.whiteMaterial = self.materialScore["w"]
+        record.blackMaterial = self.materialScore["b"]
+        record.whitePosition = self.positionScore["w"]
+        record.blackPosition = self.positionScore["b"]
+
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.board[move.startRow][move.startCol] = "--"
         self.moveLog.append(move)  # lg the move so we can undo it later
         self.whiteToMove = not self.whiteToMove  # swap players
+        startSq = move.startRow * 8 + move.startCol
+        endSq = move.endRow * 8 + move.endCol
         # update the King's location if moved
         if move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
+            self.whiteKingLocation = SQUARE_COORDINATES[endSq]
         elif move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
+            self.blackKingLocation = SQUARE_COORDINATES[endSq]
 
         # if pawn moves twice, next move can capture enpassant
         if move.pieceMoved[1] == "p" and abs(move.startRow - move.endRow) == 2:
-            self.enPassantPossible = ((move.endRow + move.startRow) // 2, move.endCol)
+            self.enPassantPossible = SQUARE_COORDINATES[(startSq + endSq) // 2]
         else:
             self.enPassantPossible = ()
 
@@ -71,9 +361,7 @@ class GameState:
 
         # if pawn promotion change piece
         if move.pawnPromotion:
-            # promotedPiece = input("Promote to Q, R, B, or N: ")  # we can make this part of the ui later
-            promotedPiece = "Q"
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece
+            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + move.promotionPiece
 
         # castle move
         if move.castle:
@@ -84,48 +372,22 @@ class GameState:
                 self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]  # moves the rook
                 self.board[move.endRow][move.endCol - 2] = "--"  # erase old rook
 
-        self.enPassantPossibleLog.append(self.enPassantPossible)
+        # move counters
+        self.halfmoveClock = 0 if move.pieceMoved[1] == "p" or move.isCapture else self.halfmoveClock + 1
+        if move.pieceMoved[0] == "b":
+            self.fullmoveNumber += 1
 
-        # update castling rights - whenever it is a rock or a king move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                                 self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+        # update castling rights - whenever a king or a rook leaves its square or a rook is captured
+        self.castlingRights &= CASTLING_KEPT[startSq] & CASTLING_KEPT[endSq]
 
-    def updateCastleRights(self, move):
-        """
-        Update the castle rights given the moves
-        """
-        if move.pieceMoved == "wK":
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == "bK":
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7:
-                if move.startCol == 0:  # left rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:  # right rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == "bR":
-            if move.startRow == 0:
-                if move.startCol == 0:  # left rook
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7:  # right rook
-                    self.currentCastlingRight.bks = False
-        # IF A ROOK IS CAPTURED
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRight.bqs = False
-                elif move.endCol == 7:
-                    self.currentCastlingRight.bks = False
+        self.toggleMoveInZobristKey(move, self.board[move.endRow][move.endCol], enPassantBefore,
+                                    self.enPassantPossible, rightsBefore, self.castlingRights)
+        self.updateScores(move, self.board[move.endRow][move.endCol], 1)
+        if DEBUG_ZOBRIST:
+            assert self.zobristKey == self.computeZobristKey(), "Zobrist key out of sync after " + str(move)
+        if DEBUG_EVAL:
+            assert (self.materialScore, self.positionScore) == self.computeScores(), "Scores out of sync after " + \
+                str(move)
 
     def undoMove(self):
         """
@@ -139,9 +401,9 @@ class GameState:
 
             # update the King's location if moved
             if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
+                self.whiteKingLocation = SQUARE_COORDINATES[move.startRow * 8 + move.startCol]
             elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
+                self.blackKingLocation = SQUARE_COORDINATES[move.startRow * 8 + move.startCol]
 
             # undo enpassant is different
             if move.enPassant:
@@ -149,14 +411,18 @@ class GameState:
                 # puts thw pawn back on  the correct square it was captured from
                 self.board[move.startRow][move.endCol] = move.pieceCaptured
 
-            self.enPassantPossibleLog.pop()
-            self.enPassantPossible = self.enPassantPossibleLog[-1]
-
-            # undo castling rights
-            self.castleRightsLog.pop()  # get rid of the new castle rights from the move we are undoing
-            # set the current castle rights to the last one in the list
-            newRights = self.castleRightsLog[-1]
-            self.currentCastlingRight = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs)
+            # restore the state saved by makeMove: en passant square, counters, castling rights, key and scores
+            record = self.undoStack[len(self.moveLog)]
+            self.enPassantPossible = record.enPassantPossible
+            self.halfmoveClock = record.halfmoveClock
+            if move.pieceMoved[0] == "b":
+                self.fullmoveNumber -= 1
+            self.castlingRights = record.castlingRights
+            self.zobristKey = record.zobristKey
+            self.materialScore["w"] = record.whiteMaterial
+            self.materialScore["b"] = record.blackMaterial
+            self.positionScore["w"] = record.whitePosition
+            self.positionScore["b"] = record.blackPosition
 
             # undo castle move
             if move.castle:
@@ -171,50 +437,25 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+            if DEBUG_ZOBRIST:
+                assert self.zobristKey == self.computeZobristKey(), "Zobrist key out of sync after undoing " + str(move)
+            if DEBUG_EVAL:
+                assert (self.materialScore, self.positionScore) == self.computeScores(), \
+                    "Scores out of sync after undoing " + str(move)
+
     def getValidMoves(self):
         """
         all moves considering checks
         """
-        moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingCol = self.whiteKingLocation[0]
-        else:
-            kingRow = self.blackKingLocation[0]
-            kingCol = self.blackKingLocation[1]
-
         if self.inCheck:
-            if len(self.checks) == 1:  # only 1 check, block check or move king
-                moves = self.getAllPossiblemoves()
-                # to block a check you must move a piece into one of the squares between the enemy piece and king
-                check = self.checks[0]  # check information
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]  # enemy piece causing the check
-                validSquares = []  # squares that pieces can move to
-                # if Knight, must capture knight or move king, other pieces can be blocked
-                if pieceChecking[1] == "N":
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)  # check[2] and check[3] are
-                        # the check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            # once you get to piece end checks
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):
-                    # go through backwards when you are removing from a list as iterating
-                    if moves[i].pieceMoved[1] != "K":  # move doesn't move king, so it must block or capture
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            # move doesn't block or capture piece
-                            moves.remove(moves[i])
-            else:  # double check, king has to move
-                self.getKingMoves(kingRow, kingCol, moves)
+            moves = self.getCheckEvasions((self.inCheck, self.pins, self.checks))
         else:  # not in check so all moves are fine
             moves = self.getAllPossiblemoves()
+            if self.whiteToMove:
+                self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+            else:
+                self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
 
         if len(moves) == 0:  # either checkMate or staleMate
             if self.inCheck:
@@ -225,11 +466,69 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
+        return moves
+
+    def getCheckEvasions(self, pinsAndChecks):
+        """
+        The legal moves out of check: king moves and, against a single check, the captures of the checking piece and
+        the moves onto the squares between it and the king. The pieces that can get there are looked up from those
+        squares outwards, so no other move is ever built. pinsAndChecks is the result of checkForPinsAndChecks().
+        """
+        inCheck, pins, checks = pinsAndChecks
+        board = self.board
         if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+            (kingRow, kingCol), allyColor, moveAmount, doublePushRow = self.whiteKingLocation, "w", -1, 4
         else:
-            self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-
+            (kingRow, kingCol), allyColor, moveAmount, doublePushRow = self.blackKingLocation, "b", 1, 3
+        moves = []
+        self.getKingMoves(kingRow, kingCol, moves)
+        if len(checks) > 1:  # double check, king has to move
+            return moves
+        checkRow, checkCol, checkRowDirection, checkColDirection = checks[0]
+        checkSquare = SQUARE_COORDINATES[checkRow * 8 + checkCol]
+        if board[checkRow][checkCol][1] == "N":  # a knight check can't be blocked
+            blockSquares = ()
+        else:
+            distance = max(abs(checkRow - kingRow), abs(checkCol - kingCol))
+            ray = RAY_SQUARES[kingRow * 8 + kingCol][DIRECTIONS.index((checkRowDirection, checkColDirection))]
+            blockSquares = ray[:distance - 1]
+        pawn = allyColor + "p"
+        # a pinned piece stays on the line of its pin, so it can't capture the checking piece or block the check
+        pinned = {(pin[0], pin[1]) for pin in pins}
+
+        for square in self.attackers(checkRow, checkCol, allyColor):
+            piece = board[square[0]][square[1]]
+            if square not in pinned and piece[1] != "K":
+                if piece == pawn:
+                    moves.extend(self.pawnMoves(square, checkSquare))
+                else:
+                    moves.append(Move(square, checkSquare, board))
+        for blockSquare in blockSquares:
+            blockRow, blockCol = blockSquare
+            for square in self.attackers(blockRow, blockCol, allyColor):
+                piece = board[square[0]][square[1]]
+                if square not in pinned and piece != pawn and piece[1] != "K":
+                    moves.append(Move(square, blockSquare, board))
+            # pawns block by a push
+            pushRow = blockRow - moveAmount
+            if not 0 <= pushRow < 8:
+                continue
+            if board[pushRow][blockCol] == pawn:
+                if (pushRow, blockCol) not in pinned:
+                    moves.extend(self.pawnMoves(SQUARE_COORDINATES[pushRow * 8 + blockCol], blockSquare))
+            elif blockRow == doublePushRow and board[pushRow][blockCol] == "--" and \
+                    board[pushRow - moveAmount][blockCol] == pawn and (pushRow - moveAmount, blockCol) not in pinned:
+                moves.append(Move(SQUARE_COORDINATES[(pushRow - moveAmount) * 8 + blockCol], blockSquare, board))
+
+        # en passant takes the checking pawn, or blocks the check with the square it lands on
+        if self.enPassantPossible != () and ((checkRow + moveAmount, checkCol) == self.enPassantPossible or
+                                             self.enPassantPossible in blockSquares):
+            endRow, endCol = self.enPassantPossible
+            for square in PAWN_ATTACKER_SQUARES[allyColor][endRow * 8 + endCol]:
+                if board[square[0]][square[1]] == pawn and square not in pinned:
+                    move = Move(square, self.enPassantPossible, board)
+                    if self.isLegalMove(move, pinsAndChecks):
+                        moves.append(move)
         return moves
 
     def checkForPinsAndChecks(self):
@@ -248,54 +547,45 @@ class GameState:
             startCol = self.blackKingLocation[1]
 
         # check outward form king for pins and checks, keep track of pins.
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
+        rays = RAY_SQUARES[startRow * 8 + startCol]
+        for j in QUEEN_DIRECTIONS:
+            d = DIRECTIONS[j]
             possiblePin = ()  # reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != "K":
-                        if possiblePin == ():  # 1st allied piece could be pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:  # 2nd allied piece, so no pin or check possible in this direction
+            for i, (endRow, endCol) in enumerate(rays[j], 1):
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != "K":
+                    if possiblePin == ():  # 1st allied piece could be pinned
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                    else:  # 2nd allied piece, so no pin or check possible in this direction
+                        break
+                elif endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    # 5 possibilities here in this complex conditional
+                    # 1. orthogonally away from king and piece is a rock
+                    # 2. diagonally away from king and a piece is a bishop
+                    # 3. 1 square away diagonally from king and piece is a pawn
+                    # 4. any direction and piece is a queen
+                    # 5. any direction 1 square away and piece is a king (this is necessary to prevent a king
+                    # move to a square controlled by another king)
+                    if (0 <= j <= 3 and type == "R") or (4 <= j <= 7 and type == "B") or \
+                            (i == 1 and type == "p" and (
+                                    (enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) \
+                            or (type == "Q") or (i == 1 and type == "K"):
+                        if possiblePin == ():  # no piece blocking, so check
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        # 5 possibilities here in this complex conditional
-                        # 1. orthogonally away from king and piece is a rock
-                        # 2. diagonally away from king and a piece is a bishop
-                        # 3. 1 square away diagonally from king and piece is a pawn
-                        # 4. any direction and piece is a queen
-                        # 5. any direction 1 square away and piece is a king (this is necessary to prevent a king
-                        # move to a square controlled by another king)
-                        if (0 <= j <= 3 and type == "R") or (4 <= j <= 7 and type == "B") or \
-                                (i == 1 and type == "p" and (
-                                        (enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) \
-                                or (type == "Q") or (i == 1 and type == "K"):
-                            if possiblePin == ():  # no piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possiblePin)
-                                break
-                        else:  # enemy piece not applying check
+                        else:  # piece blocking so pin
+                            pins.append(possiblePin)
                             break
-                else:  # off board
-                    break
+                    else:  # enemy piece not applying check
+                        break
         # check  for knight checks
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))  # in L shape directions
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == "N":  # enemy knight attacking king
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        for endRow, endCol in KNIGHT_SQUARES[startRow * 8 + startCol]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] == enemyColor and endPiece[1] == "N":  # enemy knight attacking king
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
         return inCheck, pins, checks
 
     def inCheck(self):
@@ -311,13 +601,40 @@ class GameState:
         """
         Determine if the enemy can attack the square r, c
         """
-        self.whiteToMove = not self.whiteToMove  # switch to opponent's turn
-        oopMoves = self.getAllPossiblemoves()
-        self.whiteToMove = not self.whiteToMove  # switch turns back
-        for move in oopMoves:
-            if move.endRow == r and move.endCol == c:  # square is under attack
-                return True
-        return False
+        return next(self.attackers(r, c, "b" if self.whiteToMove else "w"), None) is not None
+
+    def attackers(self, r, c, color, removed=()):
+        """
+        Yield the squares of the pieces of color that attack r, c, pawns and knights first. It looks outward from the
+        square through the lookup tables, so stopping at the first attacker is cheap. Pieces on the removed squares
+        are treated as gone so sliders behind them join in.
+        """
+        board = self.board
+        sq = r * 8 + c
+        pawn, knight, bishop, rook, queen, king = (color + piece for piece in "pNBRQK")
+        for square in PAWN_ATTACKER_SQUARES[color][sq]:
+            if board[square[0]][square[1]] == pawn and square not in removed:
+                yield square
+        for square in KNIGHT_SQUARES[sq]:
+            if board[square[0]][square[1]] == knight and square not in removed:
+                yield square
+        for j, ray in enumerate(RAY_SQUARES[sq]):
+            slider = rook if j < 4 else bishop
+            for square in ray:
+                piece = board[square[0]][square[1]]
+                if piece != "--" and square not in removed:
+                    if piece == slider or piece == queen:
+                        yield square
+                    break
+        for square in KING_SQUARES[sq]:
+            if board[square[0]][square[1]] == king and square not in removed:
+                yield square
+
+    def squareAttackers(self, r, c, color, removed=()):
+        """
+        The set of squares of the pieces of color attacking r, c, for check evasion and the static exchange evaluation
+        """
+        return set(self.attackers(r, c, color, removed))
 
     def getAllPossiblemoves(self):
         """
@@ -358,22 +675,17 @@ class GameState:
             enemyColor = "w"
             kingRow, kingCol = self.blackKingLocation
 
-        pawnPromotion = False
-
         if self.board[r + moveAmount][c] == "--":  # 1 square pawn advance
-            if not piecePinned or pinDirection == (moveAmount, 0):
-                if r + moveAmount == backRow:  # if piece gets to bank rank then it is a pawn promotion
-                    pawnPromotion = True
-                moves.append(Move((r, c), (r + moveAmount, c), self.board, pawnPromotion=pawnPromotion))
+            # a pawn pinned on its file can still advance, towards the pinning piece or towards its own king
+            if not piecePinned or pinDirection[1] == 0:
+                moves.extend(self.pawnMoves((r, c), (r + moveAmount, c)))
                 if r == startRow and self.board[r + 2 * moveAmount][c] == "--":  # 2 square pawn advance
                     moves.append(Move((r, c), (r + 2 * moveAmount, c), self.board))
 
         if c - 1 >= 0:  # capture to the left
             if not piecePinned or pinDirection == (moveAmount, -1):
                 if self.board[r + moveAmount][c - 1][0] == enemyColor:
-                    if r + moveAmount == backRow:  # if piece gets to bank rank then it is a pawn promotion
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, pawnPromotion=pawnPromotion))
+                    moves.extend(self.pawnMoves((r, c), (r + moveAmount, c - 1)))
                 if (r + moveAmount, c - 1) == self.enPassantPossible:
                     attackingPiece = blockingPiece = False
                     if kingRow == r:
@@ -383,7 +695,7 @@ class GameState:
                             outsideRange = range(c + 1, 8)
                         else:  # king is right of the pawn
                             insideRange = range(kingCol - 1, c, -1)
-                            outsideRange = (c - 2, -1, -1)
+                            outsideRange = range(c - 2, -1, -1)
                         for i in insideRange:
                             if self.board[r][i] != "--":  # some other piece beside the enpassant pawn blocks
                                 blockingPiece = True
@@ -391,17 +703,16 @@ class GameState:
                             square = self.board[r][i]
                             if square[0] == enemyColor and (square[1] == "R" or square[1] == "Q"):  # attacking piece
                                 attackingPiece = True
-                            elif square != "--":
-                                blockingPiece = True
+                                break
+                            elif square != "--":  # pieces behind this one can't attack through it
+                                break
                     if not attackingPiece or blockingPiece:
-                        moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, enPassant=True))
+                        moves.append(Move((r, c), (r + moveAmount, c - 1), self.board))
 
         if c + 1 <= 7:  # capture to the right
             if not piecePinned or pinDirection == (moveAmount, 1):
                 if self.board[r + moveAmount][c + 1][0] == enemyColor:
-                    if r + moveAmount == backRow:  # if piece gets to bank rank then it is a pawn promotion
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, pawnPromotion=pawnPromotion))
+                    moves.extend(self.pawnMoves((r, c), (r + moveAmount, c + 1)))
                 if (r + moveAmount, c + 1) == self.enPassantPossible:
                     attackingPiece = blockingPiece = False
                     if kingRow == r:
@@ -411,7 +722,7 @@ class GameState:
                             outsideRange = range(c + 2, 8)
                         else:  # king is right of the pawn
                             insideRange = range(kingCol - 1, c + 1, -1)
-                            outsideRange = (c - 1, -1, -1)
+                            outsideRange = range(c - 1, -1, -1)
                         for i in insideRange:
                             if self.board[r][i] != "--":  # some other piece beside the enpassant pawn blocks
                                 blockingPiece = True
@@ -419,10 +730,19 @@ class GameState:
                             square = self.board[r][i]
                             if square[0] == enemyColor and (square[1] == "R" or square[1] == "Q"):  # attacking piece
                                 attackingPiece = True
-                            elif square != "--":
-                                blockingPiece = True
+                                break
+                            elif square != "--":  # pieces behind this one can't attack through it
+                                break
                     if not attackingPiece or blockingPiece:
-                        moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, enPassant=True))
+                        moves.append(Move((r, c), (r + moveAmount, c + 1), self.board))
+
+    def pawnMoves(self, startSq, endSq):
+        """
+        The move of a pawn to endSq, or one move per piece it can promote to if endSq is on the back row
+        """
+        if endSq[0] == 0 or endSq[0] == 7:
+            return [Move(startSq, endSq, self.board, promotionPiece=piece) for piece in Move.promotionPieces]
+        return [Move(startSq, endSq, self.board)]
 
     def getRockMoves(self, r, c, moves):
         """
@@ -439,24 +759,7 @@ class GameState:
                     self.pins.remove(self.pins[i])
                 break
 
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:  # on board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":  # empty space valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:  # enemy piece valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else:  # friendly piece invalid
-                            break
-                else:  # off board
-                    break
+        self.getSlidingMoves(r, c, moves, ROOK_DIRECTIONS, pinDirection if piecePinned else None)
 
     def getKnightMoves(self, r, c, moves):
         """
@@ -468,16 +771,13 @@ class GameState:
                 piecePinned = True
                 self.pins.remove(self.pins[i])
                 break
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))  # in L shape directions
+        if piecePinned:
+            return
         allyColor = "w" if self.whiteToMove else "b"
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:  # on board
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor:  # not an allay piece (empty or enemy piece)
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+        startSq = SQUARE_COORDINATES[r * 8 + c]
+        for endSq in KNIGHT_SQUARES[r * 8 + c]:
+            if self.board[endSq[0]][endSq[1]][0] != allyColor:  # not an allay piece (empty or enemy piece)
+                moves.append(Move(startSq, endSq, self.board))
 
     def getBishopMoves(self, r, c, moves):
         """
@@ -491,51 +791,41 @@ class GameState:
                 pinDirection = (self.pins[i][2], self.pins[i][3])
                 self.pins.remove(self.pins[i])
                 break
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # left_up, right_up, left_down, right_down
+        self.getSlidingMoves(r, c, moves, BISHOP_DIRECTIONS, pinDirection if piecePinned else None)
+
+    def getSlidingMoves(self, r, c, moves, directions, pinDirection):
+        """
+        Add the moves along the rays of the given directions, a pinned piece (pinDirection is not None) only moves
+        along the line of the pin
+        """
         enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):  # bishop can move the maximum of 7 squares
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:  # on board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == "--":  # empty space valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:  # enemy piece valid
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break
-                        else:  # friendly piece invalid
-                            break
-                else:  # off board
+        startSq = SQUARE_COORDINATES[r * 8 + c]
+        rays = RAY_SQUARES[r * 8 + c]
+        for j in directions:
+            d = DIRECTIONS[j]
+            if pinDirection is not None and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                continue
+            for endSq in rays[j]:
+                endPiece = self.board[endSq[0]][endSq[1]]
+                if endPiece == "--":  # empty space valid
+                    moves.append(Move(startSq, endSq, self.board))
+                elif endPiece[0] == enemyColor:  # enemy piece valid
+                    moves.append(Move(startSq, endSq, self.board))
+                    break
+                else:  # friendly piece invalid
                     break
 
     def getKingMoves(self, r, c, moves):
         """
         Get all the King moves for the King located at row, col and add these moves to the list
         """
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
         allyColor = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            endRow = r + rowMoves[i]
-            endCol = c + colMoves[i]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:  # on board
-                endPiece = self.board[endRow][endCol]
-                if endPiece != allyColor:  # not an ally piece (empty or enemy piece)
-                    # place king on end square and check for checks
-                    if allyColor == "w":
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    # place king back on original location
-                    if allyColor == "w":
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        startSq = SQUARE_COORDINATES[r * 8 + c]
+        for endRow, endCol in KING_SQUARES[r * 8 + c]:
+            endPiece = self.board[endRow][endCol]
+            if endPiece[0] != allyColor:  # not an ally piece (empty or enemy piece)
+                if self.squareSafeForKing(endRow, endCol):
+                    moves.append(Move(startSq, SQUARE_COORDINATES[endRow * 8 + endCol], self.board))
 
     def getQueenMoves(self, r, c, moves):
         """
@@ -550,30 +840,185 @@ class GameState:
         """
         if self.squareUnderAttack(r, c):
             return  # can't castle while we are in check
-        if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and
-                                                                    self.currentCastlingRight.bks):
+        if self.castlingRights & (WHITE_KINGSIDE if self.whiteToMove else BLACK_KINGSIDE):
             self.getKingsideCastleMoves(r, c, moves)
-        if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and
-                                                                    self.currentCastlingRight.bqs):
+        if self.castlingRights & (WHITE_QUEENSIDE if self.whiteToMove else BLACK_QUEENSIDE):
             self.getQueensideCastleMoves(r, c, moves)
 
     def getKingsideCastleMoves(self, r, c, moves):
         if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--":
             if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
-                moves.append(Move((r, c), (r, c+2), self.board, castle=True))
+                moves.append(Move((r, c), (r, c+2), self.board))
 
     def getQueensideCastleMoves(self, r, c, moves):
         if self.board[r][c - 1] == "--" and self.board[r][c - 2] == "--" and self.board[r][c - 3] == "--":
             if not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
-                moves.append(Move((r, c), (r, c - 2), self.board, castle=True))
+                moves.append(Move((r, c), (r, c - 2), self.board))
 
+    """
+    Lazy move generation for the search. Moves are generated pseudo legal (pins and checks ignored) in two stages,
+    captures and promotions first and the quiet moves after, and a move is only checked for legality with
+    isLegalMove when it is about to be searched. Only the moves that are actually reached are ever built.
+    """
 
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+    def generatePseudoLegalMoves(self, captures):
+        """
+        Yield the pseudo legal moves of the side to move: the captures and promotions if captures is True, the quiet
+        moves (castling included) otherwise
+        """
+        allyColor = "w" if self.whiteToMove else "b"
+        for r in range(8):
+            row = self.board[r]
+            for c in range(8):
+                if row[c][0] == allyColor:
+                    yield from self.moveGenerators[row[c][1]](r, c, captures)
+
+    def generatePieceMoves(self, r, c, captures):
+        """
+        Yield the pseudo legal moves of the piece on r, c for one stage
+        """
+        return self.moveGenerators[self.board[r][c][1]](r, c, captures)
+
+    def generatePawnMoves(self, r, c, captures):
+        if self.whiteToMove:
+            moveAmount, startRow, backRow, enemyColor = -1, 6, 0, "b"
+        else:
+            moveAmount, startRow, backRow, enemyColor = 1, 1, 7, "w"
+        endRow = r + moveAmount
+        if captures:
+            startSq = SQUARE_COORDINATES[r * 8 + c]
+            for endSq in PAWN_ATTACK_SQUARES["w" if self.whiteToMove else "b"][r * 8 + c]:
+                if self.board[endSq[0]][endSq[1]][0] == enemyColor:
+                    yield from self.pawnMoves(startSq, endSq)
+                elif endSq == self.enPassantPossible:
+                    yield Move(startSq, endSq, self.board)
+            if endRow == backRow and self.board[endRow][c] == "--":  # promotions are searched with the captures
+                yield from self.pawnMoves((r, c), (endRow, c))
+        elif endRow != backRow and self.board[endRow][c] == "--":
+            yield Move((r, c), (endRow, c), self.board)
+            if r == startRow and self.board[endRow + moveAmount][c] == "--":
+                yield Move((r, c), (endRow + moveAmount, c), self.board)
+
+    def generateSlidingMoves(self, r, c, captures, directions):
+        board = self.board
+        allyColor = board[r][c][0]
+        startSq = SQUARE_COORDINATES[r * 8 + c]
+        rays = RAY_SQUARES[r * 8 + c]
+        for j in directions:
+            for endSq in rays[j]:
+                endPiece = board[endSq[0]][endSq[1]]
+                if endPiece == "--":
+                    if not captures:
+                        yield Move(startSq, endSq, board)
+                else:
+                    if captures and endPiece[0] != allyColor:
+                        yield Move(startSq, endSq, board)
+                    break
+
+    def generateRookMoves(self, r, c, captures):
+        return self.generateSlidingMoves(r, c, captures, ROOK_DIRECTIONS)
+
+    def generateBishopMoves(self, r, c, captures):
+        return self.generateSlidingMoves(r, c, captures, BISHOP_DIRECTIONS)
+
+    def generateQueenMoves(self, r, c, captures):
+        return self.generateSlidingMoves(r, c, captures, QUEEN_DIRECTIONS)
+
+    def generateStepMoves(self, r, c, captures, targets):
+        board = self.board
+        allyColor = board[r][c][0]
+        startSq = SQUARE_COORDINATES[r * 8 + c]
+        for endSq in targets[r * 8 + c]:
+            endPiece = board[endSq[0]][endSq[1]]
+            if (endPiece == "--") != captures and endPiece[0] != allyColor:
+                yield Move(startSq, endSq, board)
+
+    def generateKnightMoves(self, r, c, captures):
+        return self.generateStepMoves(r, c, captures, KNIGHT_SQUARES)
+
+    def generateKingMoves(self, r, c, captures):
+        yield from self.generateStepMoves(r, c, captures, KING_SQUARES)
+        if not captures:
+            if self.whiteToMove:
+                kingside, queenside = self.castlingRights & WHITE_KINGSIDE, self.castlingRights & WHITE_QUEENSIDE
+            else:
+                kingside, queenside = self.castlingRights & BLACK_KINGSIDE, self.castlingRights & BLACK_QUEENSIDE
+            if kingside and self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--":
+                yield Move((r, c), (r, c + 2), self.board)
+            if queenside and self.board[r][c - 1] == "--" and self.board[r][c - 2] == "--" and \
+                    self.board[r][c - 3] == "--":
+                yield Move((r, c), (r, c - 2), self.board)
+
+    def getMoveFromID(self, moveID):
+        """
+        Rebuild the move with the given moveID (for example a move stored by the search) if it is pseudo legal in the
+        current position, None otherwise
+        """
+        startRow, startCol, endRow, endCol = Move.squaresFromID(moveID)
+        if self.board[startRow][startCol][0] != ("w" if self.whiteToMove else "b"):
+            return None
+        for captures in (True, False):
+            for move in self.generatePieceMoves(startRow, startCol, captures):
+                if move.moveID == moveID:
+                    return move
+        return None
+
+    def isLegalMove(self, move, pinsAndChecks):
+        """
+        Determine if a pseudo legal move is legal, pinsAndChecks is the result of checkForPinsAndChecks() for the
+        position the move is made from
+        """
+        inCheck, pins, checks = pinsAndChecks
+        if move.pieceMoved[1] == "K":
+            if move.castle:  # the king can't castle out of, through or into check
+                step = 1 if move.endCol > move.startCol else -1
+                return not inCheck and self.squareSafeForKing(move.endRow, move.startCol + step) and \
+                    self.squareSafeForKing(move.endRow, move.endCol)
+            return self.squareSafeForKing(move.endRow, move.endCol)
+        if len(checks) > 1:  # double check, king has to move
+            return False
+        if move.enPassant:
+            # two pawns leave the row at once, so just try it
+            self.makeMove(move)
+            self.whiteToMove = not self.whiteToMove
+            exposed = self.checkForPinsAndChecks()[0]
+            self.whiteToMove = not self.whiteToMove
+            self.undoMove()
+            return not exposed
+        for pin in pins:
+            if pin[0] == move.startRow and pin[1] == move.startCol:
+                if move.pieceMoved[1] == "N":
+                    return False
+                # a pinned piece can only move along the line of the pin
+                rowDirection = (move.endRow > move.startRow) - (move.endRow < move.startRow)
+                colDirection = (move.endCol > move.startCol) - (move.endCol < move.startCol)
+                if (rowDirection, colDirection) != (pin[2], pin[3]) and \
+                        (rowDirection, colDirection) != (-pin[2], -pin[3]):
+                    return False
+                break
+        if inCheck:  # single check, the move has to capture the checking piece or block the check
+            checkRow, checkCol, checkRowDirection, checkColDirection = checks[0]
+            if move.endRow == checkRow and move.endCol == checkCol:
+                return True
+            if self.board[checkRow][checkCol][1] == "N":
+                return False
+            kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+            distance = max(abs(move.endRow - kingRow), abs(move.endCol - kingCol))
+            return distance < max(abs(checkRow - kingRow), abs(checkCol - kingCol)) and \
+                kingRow + checkRowDirection * distance == move.endRow and \
+                kingCol + checkColDirection * distance == move.endCol
+        return True
+
+    def squareSafeForKing(self, r, c):
+        """
+        Determine if the king of the side to move could stand on r, c without being in check
+        """
+        if self.whiteToMove:
+            kingLocation, enemyColor = self.whiteKingLocation, "b"
+        else:
+            kingLocation, enemyColor = self.blackKingLocation, "w"
+        # the king is taken off its square so it does not shield the squares behind it from a slider
+        return next(self.attackers(r, c, enemyColor, (kingLocation,)), None) is None
 
 
 class Move:
@@ -589,36 +1034,66 @@ class Move:
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3, "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, castle=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-
-        self.enPassant = enPassant
-        self.pawnPromotion = self.pieceMoved[1] == "p" and (self.endRow == 0 or self.endRow == 7)
+    promotionPieces = ("Q", "R", "B", "N")
 
-        if enPassant:
-            self.pieceCaptured = "bp" if self.pieceMoved == "wp" else "wp"  # enpassant captures opposite colored pawn
+    # no __dict__ per move, the search builds one for every move it generates
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "enPassant",
+                 "pawnPromotion", "promotionPiece", "castle", "isCapture", "moveID")
 
-        # castle moves
-        self.castle = castle
+    def __init__(self, startSq, endSq, board, promotionPiece="Q"):
+        """
+        En passant, castling and promotion are recognized from the board, so a move built from just the two squares
+        clicked in the GUI is equal to the move generated for them
+        """
+        self.startRow = startRow = startSq[0]
+        self.startCol = startCol = startSq[1]
+        self.endRow = endRow = endSq[0]
+        self.endCol = endCol = endSq[1]
+        self.pieceMoved = pieceMoved = board[startRow][startCol]
+        self.pieceCaptured = board[endRow][endCol]
+        self.promotionPiece = promotionPiece
+        self.enPassant = self.pawnPromotion = self.castle = False
+        flags = 0
+        if pieceMoved[1] == "p":
+            if endRow == 0 or endRow == 7:
+                self.pawnPromotion = True
+                flags = PROMOTION_FLAG | self.promotionPieces.index(promotionPiece)
+            elif startCol != endCol and self.pieceCaptured == "--":
+                self.enPassant = True
+                self.pieceCaptured = "bp" if pieceMoved == "wp" else "wp"  # enpassant captures opposite colored pawn
+                flags = EN_PASSANT_FLAG
+            elif endRow - startRow == 2 or startRow - endRow == 2:
+                flags = DOUBLE_PUSH_FLAG
+        elif pieceMoved[1] == "K" and (endCol - startCol == 2 or startCol - endCol == 2):
+            self.castle = True
+            flags = CASTLE_FLAG
         self.isCapture = self.pieceCaptured != "--"
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        if self.isCapture:
+            flags |= CAPTURE_FLAG
+        self.moveID = startRow * 8 + startCol | (endRow * 8 + endCol) << 6 | flags << 12
 
     def __eq__(self, other):
         """
         Overriding the equals method
         """
-        if isinstance(other, Move):
-            return self.moveID == other.moveID
-        return False
+        return other.__class__ is Move and self.moveID == other.moveID
+
+    def __hash__(self):
+        return self.moveID
+
+    @staticmethod
+    def squaresFromID(moveID):
+        """
+        (startRow, startCol, endRow, endCol) of a moveID
+        """
+        return moveID >> 3 & 7, moveID & 7, moveID >> 9 & 7, moveID >> 6 & 7
 
     def getChessNotation(self):
         # you can add to make this real chess notation
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.pawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -633,14 +1108,12 @@ class Move:
 
         endSquare = self.getRankFile(self.endRow, self.endCol)
 
-        # pawn moves
+        # pawn moves and pawn promotions
         if self.pieceMoved[1] == "p":
-            if self.isCapture:
-                return self.colsToFiles[self.startCol] + "x" + endSquare
-            else:
-                return endSquare
-
-        # pawn promotions
+            moveString = self.colsToFiles[self.startCol] + "x" + endSquare if self.isCapture else endSquare
+            if self.pawnPromotion:
+                moveString += "=" + self.promotionPiece
+            return moveString
 
         # two of the same type of piece moving to a square, Nbd2 if both knights can move to d2
         # also adding + for check move, and # for checkmate move
@@ -5,18 +5,18 @@ user input and displaying the current GameState object.
 
 import pygame as p
 from ChessEngine import GameState, Move
-from SmartMoveFinnder import findBestMove, findRandomMove
-
-from multiprocessing import Process, Queue
+from EngineWorker import EngineWorker
 
 BOARD_WIDTH = BOARD_HEIGHT = 512  # 400 IS ANOTHER OPTION
 MOVE_LOG_PANEL_WIDTH = 250
 MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8  # DIMENSION OF CHESS BOARD IS 8X8
 SQ_SIZE = BOARD_HEIGHT // 8  # DIMENSION OF SQUARE
-MAX_FPS = 15  # ANIMATIONS LATER ON
+MAX_FPS = 15  # frames per second while nothing moves
+ANIMATION_FPS = 60  # frames per second while a move is animated
+ANIMATION_MS_PER_SQUARE = 100  # time an animated piece takes to travel one square, rank and file steps add up
 IMAGES = {}
-global colors
+BOARD_COLORS = (p.Color("white"), p.Color("gray"))  # light and dark squares
 
 """
 Initialize a global dictionary of images. this will be called exactly once in the main.
@@ -40,6 +40,7 @@ def main():
     screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
+    p.display.flip()
     moveLogFont = p.font.SysFont("Arial", 14, False, False)
     gs = GameState()
     validMoves = gs.getValidMoves()
@@ -47,6 +48,7 @@ def main():
     moveMade = False  # flag variable for when a move is made
     animate = False  # flag variable for when we should animate a move
     load_images()  # only do this once, before the while loop.
+    view = BoardView(screen, moveLogFont)
     running = True
     sqSelected = ()  # no square is selected, keep track of the last click if the user (tuple: (row, col))
     playerClicks = []  # keep track of the player clicks (two tuples: [(6, 4), (4, 4)])
@@ -54,7 +56,7 @@ def main():
     playerOne = False  # if a human is playing white, then this will be true. If AI is playing, then false.
     playerTwo = True  # same as above but for black
     AIThinking = False
-    moveFinderProcess = None
+    engine = EngineWorker()  # searches for the AI in its own process for the whole game
     moveUndone = False
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
@@ -62,7 +64,9 @@ def main():
             if e.type == p.QUIT:
                 running = False
             # mouse handler
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.MOUSEWHEEL:
+                view.moveLog.scroll(e.y)  # up scrolls back to older moves
+            elif e.type == p.MOUSEBUTTONDOWN and e.button not in (4, 5):  # 4 and 5 are the wheel again
                 if not gameOver:
                     location = p.mouse.get_pos()  # (x, y) location of mouse
                     col = location[0] // SQ_SIZE
@@ -94,9 +98,8 @@ def main():
                     moveMade = True
                     animate = False
                     gameOver = False
-                    if AIThinking:
-                        moveFinderProcess.terminate()
-                        AIThinking = False
+                    engine.cancel()  # also stops the pondering
+                    AIThinking = False
                     moveUndone = True
 
                 if e.key == p.K_r:  # reset the board when "r" is pressed
@@ -107,9 +110,8 @@ def main():
                     moveMade = False
                     animate = False
                     gameOver = False
-                    if AIThinking:
-                        moveFinderProcess.terminate()
-                        AIThinking = False
+                    engine.cancel()  # also stops the pondering
+                    AIThinking = False
                     moveUndone = True
 
         # AI move finder
@@ -117,48 +119,128 @@ def main():
             if not AIThinking:
                 AIThinking = True
                 print("Thinking...")
-                returnQueue = Queue()  # used to pass data between threads
-                moveFinderProcess = Process(target=findBestMove, args=(gs, validMoves, returnQueue))
-                moveFinderProcess.start()  # call findBestMove(gs, validMoves, returnQueue)
+                engine.go(gs)  # the engine is only sent the moves played since its last search
 
-            if not moveFinderProcess.is_alive():
+            AIMove = engine.getBestMove(validMoves)
+            if AIMove is not None:
                 print("Done thinking")
-                AIMove = returnQueue.get()
-                if AIMove is None:
-                    AIMove = findRandomMove(validMoves)
                 gs.makeMove(AIMove)
                 moveMade = True
                 animate = True
                 AIThinking = False
+                if (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo):
+                    engine.ponder(gs)  # think on the human's time, the next go uses it
 
         if moveMade:
             if animate:
-                animatedMove(gs.moveLog[-1], screen, gs.board, clock)
+                view.animate(gs.moveLog[-1])  # played by the next frames, events and the engine are still handled
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
             moveUndone = False
 
-        drawGameState(screen, gs, validMoves, sqSelected, moveLogFont)
-
         if gs.checkmate or gs.stalemate:
             gameOver = True
-            drawEndGameText(screen, "Stalemate" if gs.stalemate else "Black wins by checkmate" if gs.whiteToMove else "White wins by checkmate")
-
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-"""
-Responsible for all the graphics within a current game state.
-"""
-
-
-def drawGameState(screen, gs, validMoves, sqSelected, moveLogFont):
-    drawBoard(screen)  # draw squares on the board.
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)  # draw pieces on top of those squares.
-    drawMoveLog(screen, gs, moveLogFont)
+        endGameText = None
+        if gameOver:
+            endGameText = "Stalemate" if gs.stalemate else "Black wins by checkmate" if gs.whiteToMove else "White wins by checkmate"
+        view.draw(gs, validMoves, sqSelected, endGameText)  # only what changed since the last frame
+
+        clock.tick(ANIMATION_FPS if view.animation is not None else MAX_FPS)
+    engine.quit()
+
+
+class BoardView:
+    """
+    Retained mode drawing of the window. The squares are drawn once onto a background surface, and every frame only the
+    squares whose piece or highlight changed are drawn again and only their rectangles are sent to the display, so a
+    frame where nothing changed costs next to nothing.
+    """
+
+    def __init__(self, screen, moveLogFont):
+        self.screen = screen
+        self.moveLog = MoveLogView(moveLogFont, p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT))
+        self.endGameFont = p.font.SysFont("Helvetica", 32, True, False)
+        self.background = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        drawBoard(self.background)
+        self.selectedHighlight = highlightSurface("blue")
+        self.moveHighlight = highlightSurface("yellow")
+        self.squares = [None] * (DIMENSION * DIMENSION)  # (piece, highlight) each square shows, None to draw it again
+        self.endGameText = None
+        self.animation = None  # the MoveAnimation being played
+        self.spriteRect = None  # where the animated piece was drawn in the last frame
+
+    def animate(self, move):
+        """
+        Slide the piece of a move that was just made from its start square to its end square over the next frames.
+        An animation still playing is cut short.
+        """
+        self.animation = MoveAnimation(move, p.time.get_ticks())
+
+    def invalidateBoard(self):
+        """
+        Draw every square again on the next frame, after something else has drawn over the board
+        """
+        self.squares = [None] * (DIMENSION * DIMENSION)
+
+    def draw(self, gs, validMoves, sqSelected, endGameText=None):
+        dirtyRects = []
+        if endGameText != self.endGameText:
+            self.invalidateBoard()  # the text covers the middle of the board, or did
+            self.endGameText = endGameText
+        now = p.time.get_ticks()
+        if self.animation is not None and (self.animation.done(now) or not gs.moveLog or
+                                           gs.moveLog[-1] is not self.animation.move):
+            self.animation = None  # played to the end, or its move was taken back
+        highlights = self.squareHighlights(gs, validMoves, sqSelected)
+        squares = [(gs.board[r][c], highlights.get((r, c))) for r in range(DIMENSION) for c in range(DIMENSION)]
+        spriteRect = None
+        if self.animation is not None:
+            for (r, c), piece in self.animation.piecesUnderneath().items():
+                squares[r * DIMENSION + c] = (piece, highlights.get((r, c)))
+            spriteRect = self.animation.spriteRect(now)
+        for rect in (self.spriteRect, spriteRect):  # the squares the piece leaves and the ones it moves over
+            if rect is not None:
+                for i in coveredSquares(rect):
+                    self.squares[i] = None
+        changed = [i for i, square in enumerate(squares) if square != self.squares[i]]
+        if changed and endGameText is not None:
+            changed = range(len(squares))  # clear the whole board under the text before it is drawn again
+        for i in changed:
+            dirtyRects.append(self.drawSquare(i // DIMENSION, i % DIMENSION, *squares[i]))
+        self.squares = squares
+        if spriteRect is not None:
+            self.screen.blit(IMAGES[self.animation.move.pieceMoved], spriteRect)
+        self.spriteRect = spriteRect
+        if changed and endGameText is not None:
+            dirtyRects.append(drawEndGameText(self.screen, endGameText, self.endGameFont))
+        if self.moveLog.refresh(gs.moveLog):
+            dirtyRects.append(self.moveLog.draw(self.screen))
+        if dirtyRects:
+            p.display.update(dirtyRects)
+
+    def squareHighlights(self, gs, validMoves, sqSelected):
+        """
+        Highlights square selected and moves for piece selected, as {(row, col): highlight surface}
+        """
+        highlights = {}
+        if sqSelected != ():
+            r, c = sqSelected
+            if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):  # sqSelected is a piece that can be moved
+                highlights[(r, c)] = self.selectedHighlight
+                for move in validMoves:
+                    if move.startRow == r and move.startCol == c:
+                        highlights[(move.endRow, move.endCol)] = self.moveHighlight
+        return highlights
+
+    def drawSquare(self, r, c, piece, highlight):
+        rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(highlight, rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
 
 
 """
@@ -166,128 +248,141 @@ draw squares on the board. The top left square is always light.
 """
 
 
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
+def drawBoard(surface):
     for r in range(DIMENSION):
         for c in range(DIMENSION):
-            color = colors[((r + c) % 2)]
+            color = BOARD_COLORS[((r + c) % 2)]
             """
             All white colors on chess board have the answer even when we add both the quadrants and odd in the case of
              black, we will take the reminder if is even return 0 = white and odd 1 = black on colors list.
             """
-            p.draw.rect(screen, color, p.rect.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))  # DOING COLUMN BY ROW
-
-
-"""
-Highlights square selected and moves for piece selected
-"""
-
-
-def highlightSquares(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        r, c = sqSelected
-        if gs.board[r][c][0] == ("w" if gs.whiteToMove else "b"):  # sqSelected is a piece that can be moved
-
-            # highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)  # transparency value -> transparent; 255 opaque
-            s.fill(p.Color("blue"))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
+            p.draw.rect(surface, color, p.rect.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))  # DOING COLUMN BY ROW
 
-            # highlight moves from that square
-            s.fill(p.Color("yellow"))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
 
+def highlightSurface(color):
+    surface = p.Surface((SQ_SIZE, SQ_SIZE))
+    surface.set_alpha(100)  # transparency value -> transparent; 255 opaque
+    surface.fill(p.Color(color))
+    return surface
 
-"""
-Draw the pieces on the board using the current GameState.board.
-"""
-
-
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":  # not an empty space
-                screen.blit(IMAGES[piece], p.rect.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-
-"""
-draws the move log
-"""
+def coveredSquares(rect):
+    """
+    Indexes of the squares a rectangle on the board overlaps
+    """
+    rows = range(max(0, rect.top // SQ_SIZE), min(DIMENSION, (rect.bottom - 1) // SQ_SIZE + 1))
+    cols = range(max(0, rect.left // SQ_SIZE), min(DIMENSION, (rect.right - 1) // SQ_SIZE + 1))
+    return [r * DIMENSION + c for r in rows for c in cols]
 
 
-def drawMoveLog(screen, gs, font):
-    moveLogRect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color("black"), moveLogRect)
-    moveLog = gs.moveLog
-    moveTexts = []
-    for i in range(0, len(moveLog), 2):
-        moveString = str(i//2 + 1) + ". " + str(moveLog[i]) + " "
-        if i + 1 < len(moveLog):  # make sure black made a move
-            moveString += str(moveLog[i + 1]) + "  "
-        moveTexts.append(moveString)
-    # 1. f2f4 f5h5 2. f2f4 f5h5 3. f1f1 e4e4
+class MoveLogView:
+    """
+    The move log panel. Every line is rendered once and kept: a move made or taken back only renders the lines from
+    that move on again, usually just the last one, and only the lines that fit in the panel are drawn, the newest at the
+    bottom unless the panel has been scrolled back with the mouse wheel.
+    """
     movesPerRow = 3
     padding = 5
     lineSpacing = 2
-    textY = padding
-    for i in range(0, len(moveTexts), movesPerRow):
-        text = ""
-        for j in range(movesPerRow):
-            if i + j < len(moveTexts):
-                text += moveTexts[i + j]
-        textObject = font.render(text, True, p.Color("white"))
-        textLocation = moveLogRect.move(padding, textY)
-        screen.blit(textObject, textLocation)
-        textY += textObject.get_height() + lineSpacing
-
-
-"""
-Animating a move
-"""
 
-
-def animatedMove(move, screen, board, clock):
-    global colors
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10  # frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = (move.startRow + dR * frame / frameCount, move.startCol + dC * frame / frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-
-        # erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.rect.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-
-        # draw captured piece onto rectangle
-        if move.pieceCaptured != "--":
-            if move.enPassant:
-                enPassantRow = move.endRow + 1 if move.pieceCaptured[0] == "b" else move.endRow - 1
-                endSquare = p.rect.Rect(move.endCol * SQ_SIZE, enPassantRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-
-        # draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.rect.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
-
-def drawEndGameText(screen, text):
-    font = p.font.SysFont("Helvetica", 32, True, False)
+    def __init__(self, font, rect):
+        self.font = font
+        self.rect = rect
+        self.moves = []  # the moves the lines were made from
+        self.lines = []  # rendered text surfaces, movesPerRow moves each
+        self.lineHeight = font.get_height() + self.lineSpacing
+        self.visibleLines = max(1, (rect.height - self.padding) // self.lineHeight)
+        self.scrollBack = 0  # lines scrolled back from the newest one
+        self.dirty = True
+
+    def refresh(self, moveLog):
+        """
+        Bring the lines up to date with the move log, returns True if the panel has to be drawn again. The moves are
+        compared by identity, which is cheap every frame: a move played after a take back is always a new Move.
+        """
+        if len(moveLog) != len(self.moves) or (moveLog and moveLog[-1] is not self.moves[-1]):
+            common = 0
+            while common < min(len(moveLog), len(self.moves)) and moveLog[common] is self.moves[common]:
+                common += 1
+            self.moves = list(moveLog)
+            pliesPerLine = 2 * self.movesPerRow
+            del self.lines[common // pliesPerLine:]
+            for lineStart in range(len(self.lines) * pliesPerLine, len(self.moves), pliesPerLine):
+                self.lines.append(self.font.render(self.lineText(lineStart), True, p.Color("white")))
+            self.scrollBack = 0
+            self.dirty = True
+        return self.dirty
+
+    def lineText(self, lineStart):
+        # 1. f2f4 f5h5 2. f2f4 f5h5 3. f1f1 e4e4
+        text = ""
+        for i in range(lineStart, min(lineStart + 2 * self.movesPerRow, len(self.moves)), 2):
+            text += str(i // 2 + 1) + ". " + str(self.moves[i]) + " "
+            if i + 1 < len(self.moves):  # make sure black made a move
+                text += str(self.moves[i + 1]) + "  "
+        return text
+
+    def scroll(self, lines):
+        """
+        Scroll back (positive) or forward (negative) through the lines
+        """
+        scrollBack = max(0, min(self.scrollBack + lines, len(self.lines) - self.visibleLines))
+        if scrollBack != self.scrollBack:
+            self.scrollBack = scrollBack
+            self.dirty = True
+
+    def draw(self, screen):
+        p.draw.rect(screen, p.Color("black"), self.rect)
+        last = len(self.lines) - self.scrollBack
+        textY = self.rect.top + self.padding
+        for line in self.lines[max(0, last - self.visibleLines):last]:
+            screen.blit(line, (self.rect.left + self.padding, textY))
+            textY += self.lineHeight
+        self.dirty = False
+        return self.rect
+
+
+class MoveAnimation:
+    """
+    A move being animated, as a tween on the clock: where the piece is follows from the time since the move was made,
+    so the animation takes the same time whatever the frame rate. The board already shows the move, so its end square
+    shows what was there before until the piece arrives.
+    """
+
+    def __init__(self, move, startTime):
+        self.move = move
+        self.startTime = startTime
+        squares = abs(move.endRow - move.startRow) + abs(move.endCol - move.startCol)
+        self.duration = squares * ANIMATION_MS_PER_SQUARE
+
+    def done(self, now):
+        return now - self.startTime >= self.duration
+
+    def piecesUnderneath(self):
+        """
+        {(row, col): piece} of the squares that show something else than the board while the piece moves
+        """
+        move = self.move
+        if move.enPassant:
+            capturedRow = move.endRow + 1 if move.pieceCaptured[0] == "b" else move.endRow - 1
+            return {(move.endRow, move.endCol): "--", (capturedRow, move.endCol): move.pieceCaptured}
+        return {(move.endRow, move.endCol): move.pieceCaptured}
+
+    def spriteRect(self, now):
+        fraction = min(1.0, (now - self.startTime) / self.duration)
+        r = self.move.startRow + (self.move.endRow - self.move.startRow) * fraction
+        c = self.move.startCol + (self.move.endCol - self.move.startCol) * fraction
+        return p.Rect(round(c * SQ_SIZE), round(r * SQ_SIZE), SQ_SIZE, SQ_SIZE)
+
+
+def drawEndGameText(screen, text, font):
     textObject = font.render(text, True, p.Color("Gray"))
     textLocation = p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT).move(BOARD_WIDTH / 2 - textObject.get_width() / 2, BOARD_HEIGHT / 2 -
                                                                 textObject.get_height() / 2)
     screen.blit(textObject, textLocation)
     textObject = font.render(text, True, p.Color("Black"))
     screen.blit(textObject, textLocation.move(2, 2))
+    return textLocation.union(textLocation.move(2, 2))
 
 
 """
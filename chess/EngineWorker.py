@@ -0,0 +1,176 @@
+"""
+Engine process that stays up for the whole game. The GUI only sends it the moves played since the last search (or a
+FEN for a new game) instead of a new process and a pickled GameState for every AI move, so the engine keeps its own
+game state and its transposition table, killers and history stay warm from one move to the next.
+
+While the human thinks the engine ponders: it plays the reply its last search expected and searches the position after
+it. If the human plays that move the search result is used at once, or the search goes on with the tables it filled,
+otherwise the ponder search is stopped and the normal search starts.
+"""
+
+from multiprocessing import Event, Process, Queue, Value
+import atexit
+import queue
+import time
+
+from ChessEngine import GameState
+from TranspositionTable import NO_MOVE
+import SmartMoveFinnder
+
+
+class EngineWorker:
+
+    def __init__(self, maxTime=SmartMoveFinnder.THINK_TIME, processes=SmartMoveFinnder.SEARCH_PROCESSES,
+                 gameStateClass=GameState):
+        self.maxTime = maxTime
+        self.commands = Queue()
+        self.results = Queue()
+        self.stopEvent = Event()  # stops the running search
+        self.searchID = Value("i", 0, lock=False)  # id of the search the GUI is waiting for, 0 for none
+        self.searchCount = 0
+        # not a daemon because the parallel search starts helper processes from it, so it is shut down at exit instead
+        self.process = Process(target=engineLoop, args=(self.commands, self.results, self.stopEvent, self.searchID,
+                                                        gameStateClass, processes))
+        self.startFen = None  # position and moves the engine has been sent
+        self.moveIDs = []
+        self.process.start()
+        atexit.register(self.quit)
+
+    def syncPosition(self, gs):
+        """
+        Send the engine what changed since the last search: undo the moves taken back and play the new ones
+        """
+        commands, self.startFen, self.moveIDs = SmartMoveFinnder.positionCommands(gs, self.startFen, self.moveIDs)
+        for command in commands:
+            self.commands.put(command)
+
+    def go(self, gs, maxTime=None):
+        """
+        Start searching the position of gs, getBestMove returns the result once it is ready
+        """
+        self.cancel()
+        self.syncPosition(gs)
+        self.searchCount += 1
+        self.searchID.value = self.searchCount
+        self.commands.put(("go", self.searchCount, self.maxTime if maxTime is None else maxTime))
+
+    def ponder(self, gs):
+        """
+        Search on the human's time, after the engine's move has been played on gs. The next go stops it.
+        """
+        self.cancel()
+        self.syncPosition(gs)
+        self.searchCount += 1
+        self.searchID.value = self.searchCount
+        self.commands.put(("ponder", self.searchCount))
+
+    def cancel(self):
+        """
+        Stop the search the GUI is waiting for or the pondering, the result is dropped
+        """
+        if self.searchID.value:
+            self.searchID.value = 0
+            self.stopEvent.set()
+
+    def getBestMove(self, validMoves):
+        """
+        The move out of validMoves the engine found, None if the search is still running. When the search found no move
+        (or was cut short before depth 1) the first valid move is returned.
+        """
+        try:
+            while True:
+                searchID, moveID = self.results.get_nowait()
+                if searchID == self.searchID.value:
+                    self.searchID.value = 0
+                    return next((move for move in validMoves if move.moveID == moveID), validMoves[0])
+        except queue.Empty:
+            if not self.process.is_alive():
+                raise RuntimeError("The engine process has stopped")
+            return None
+
+    def quit(self):
+        if not self.process.is_alive():
+            return
+        self.cancel()
+        self.commands.put(("quit",))
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def engineLoop(commands, results, stopEvent, searchID, gameStateClass, processes):
+    """
+    Body of the engine process: keeps a game state in step with the GUI and searches it on request
+    """
+    SmartMoveFinnder.stopEvent = stopEvent
+    gs = gameStateClass()
+    if processes > 1:
+        SmartMoveFinnder.startSearchHelpers(processes, gameStateClass)  # kept for every search of the game
+    prediction = None  # (key of the position after the engine's move, the reply the search expects)
+    ponderResult = None  # (key of the position pondered, best move ID, depth, seconds searched)
+    while True:
+        command = commands.get()
+        if SmartMoveFinnder.applyPositionCommand(gs, command):
+            continue
+        if command[0] == "go":
+            stopEvent.clear()
+            if searchID.value != command[1]:
+                continue  # cancelled before it started, the stop event is cleared first so a later cancel still works
+            validMoves = gs.getValidMoves()
+            bestMove = SmartMoveFinnder.findBookMove(gs, validMoves)
+            if bestMove is None:
+                bestMove = SmartMoveFinnder.findTablebaseMove(gs, validMoves)
+            iterations = []
+            if bestMove is None:
+                bestMove, iterations = search(gs, validMoves, command[2], processes, ponderResult)
+            ponderResult = None
+            prediction = None
+            if bestMove is not None and iterations and len(iterations[-1]["pv"]) > 1:
+                gs.makeMove(bestMove)
+                prediction = (gs.zobristKey, iterations[-1]["pv"][1].moveID)
+                gs.undoMove()
+            results.put((command[1], NO_MOVE if bestMove is None else bestMove.moveID))
+        elif command[0] == "ponder":
+            stopEvent.clear()
+            if searchID.value != command[1] or prediction is None or prediction[0] != gs.zobristKey:
+                continue
+            ponderResult = ponder(gs, prediction[1], processes)
+        elif command[0] == "quit":
+            break
+    SmartMoveFinnder.closeSharedTable()
+
+
+def search(gs, validMoves, maxTime, processes, ponderResult):
+    """
+    The search of a go. After a ponder hit the time already spent pondering counts, the pondered move is played at once
+    when that was enough, and otherwise the search picks up with the tables the pondering filled.
+    """
+    if ponderResult is None or ponderResult[0] != gs.zobristKey:
+        return SmartMoveFinnder.parallelSearch(gs, validMoves, maxTime, processes=processes)
+    key, ponderMoveID, ponderDepth, ponderTime = ponderResult
+    ponderMove = next(move for move in validMoves if move.moveID == ponderMoveID)
+    if ponderTime >= maxTime:
+        return ponderMove, []
+    bestMove, iterations = SmartMoveFinnder.parallelSearch(gs, validMoves, maxTime - ponderTime, processes=processes)
+    if not iterations or iterations[-1]["depth"] < ponderDepth:
+        return ponderMove, iterations  # the rest of the time was not enough to get past the pondering
+    return bestMove, iterations
+
+
+def ponder(gs, predictedMoveID, processes):
+    """
+    Play the predicted reply and search until stopped, returns the ponder result or None
+    """
+    move = gs.getMoveFromID(predictedMoveID)
+    if move is None or move not in gs.getValidMoves():
+        return None
+    gs.makeMove(move)
+    ponderResult = None
+    validMoves = gs.getValidMoves()
+    if validMoves and SmartMoveFinnder.findTablebaseMove(gs, validMoves) is None:
+        start = time.perf_counter()
+        bestMove, iterations = SmartMoveFinnder.parallelSearch(gs, validMoves, None, processes=processes)
+        if iterations:
+            ponderResult = (gs.zobristKey, bestMove.moveID, iterations[-1]["depth"], time.perf_counter() - start)
+    gs.undoMove()
+    return ponderResult
@@ -0,0 +1,345 @@
+"""
+Self-play matches between two engine configurations, to tell whether a change makes the engine stronger or just
+slower. Games are played in parallel over a process pool, every opening once with each color, and the result of each
+game is appended to a JSONL file as soon as it is finished, so an interrupted match picks up where it stopped when it
+is started again with the same file. The match stops early once the SPRT accepts one of its two hypotheses.
+
+An engine configuration is a JSON object, every key is optional:
+    "name"      shown in the reports and the results file
+    "maxTime"   seconds per move, "maxNodes" nodes per move and "maxDepth" plies per move (default 3)
+    "hashMB"    size of the engine's transposition table
+    "book"      true to play moves from the opening book
+    "evaluation" tables of Evaluation to play with instead of the default ones: "pieceScore" with the values of some
+                pieces, like {"Q": 9}, and "piecePositionScores" with some of the 8x8 tables, like {"N": [[...], ...]}
+    "options"   module attributes set while the engine searches, like {"SmartMoveFinnder.USE_SEE_PRUNING": false};
+                names without a module are SmartMoveFinnder attributes. Attributes that are copied when modules are
+                imported or only read when the engine is set up are rejected, see FIXED_ATTRIBUTES.
+Each engine plays on a game state of its own, which keeps the running scores with the tables of its evaluation.
+
+Usage (from the chess folder):
+    python Match.py --engine1 '{"maxDepth": 4}' --engine2 '{"maxDepth": 3}' [--openings FILE] [--games N]
+                    [--processes N] [--output FILE] [--elo0 E] [--elo1 E] [--alpha A] [--beta B]
+The openings file has one FEN (or EPD) per line, the standard start position is used without one.
+"""
+
+import argparse
+import importlib
+import json
+import math
+import numbers
+import os
+import random
+from multiprocessing import Pool
+
+from ChessEngine import GameState, START_FEN
+from MoveOrdering import MoveOrderer
+from TranspositionTable import TranspositionTable
+import Evaluation
+import SmartMoveFinnder
+
+DEFAULT_CONFIG = {"name": None, "maxTime": None, "maxNodes": None, "maxDepth": 3, "hashMB": 16, "book": False,
+                  "evaluation": {}, "options": {}}
+# attributes an option can't change and what to set instead: the evaluation tables are copied into the game state and
+# the other modules when they are imported, the rest is only read when the engine is set up
+FIXED_ATTRIBUTES = dict({name: '"evaluation"' for name in vars(Evaluation) if not name.startswith("__")},
+                        HASH_SIZE_MB='"hashMB"', THINK_TIME='"maxTime"', MAX_DEPTH='"maxDepth"',
+                        MAX_PLY="nothing", SEARCH_PROCESSES="nothing", OPENING_BOOK_PATH="nothing",
+                        TABLEBASE_PATH="nothing")
+MAX_PLIES = 400  # games still running after this many plies are adjudicated as draws
+RESULT_SCORES = {"1-0": 1.0, "1/2-1/2": 0.5, "0-1": 0.0}  # score of white
+
+
+def loadConfig(text, defaultName):
+    """
+    The engine configuration of a JSON object, with the defaults filled in
+    """
+    config = json.loads(text) if text else {}
+    if not isinstance(config, dict):
+        raise ValueError("An engine configuration must be a JSON object: " + text)
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError("Unknown engine configuration keys: " + ", ".join(sorted(unknown)))
+    config = dict(DEFAULT_CONFIG, **config)
+    if config["name"] is None:
+        config["name"] = defaultName
+    buildEvaluation(config["evaluation"])
+    for name in config["options"]:
+        optionAttribute(name)
+    return config
+
+
+def buildEvaluation(evaluation):
+    """
+    (pieceScore, pieceSquareScores) of the "evaluation" object of a configuration: the tables of Evaluation with its
+    entries put in, None for the default evaluation
+    """
+    if not evaluation:
+        return None
+    unknown = set(evaluation) - {"pieceScore", "piecePositionScores"}
+    if unknown:
+        raise ValueError("Unknown evaluation keys: " + ", ".join(sorted(unknown)))
+    pieceScore = dict(Evaluation.pieceScore)
+    for piece, value in evaluation.get("pieceScore", {}).items():
+        if piece not in pieceScore or piece == "K":
+            raise ValueError("pieceScore has no piece %r, the pieces are Q R B N p" % piece)
+        if not isinstance(value, numbers.Real) or value <= 0:
+            raise ValueError("The value of %s must be a positive number" % piece)
+        pieceScore[piece] = value
+    piecePositionScores = dict(Evaluation.piecePositionScores)
+    for piece, table in evaluation.get("piecePositionScores", {}).items():
+        if piece not in piecePositionScores:
+            raise ValueError("piecePositionScores has no table %r, the tables are %s" % (
+                piece, " ".join(Evaluation.piecePositionScores)))
+        if not isinstance(table, list) or len(table) != 8 or any(
+                not isinstance(row, list) or len(row) != 8 or
+                not all(isinstance(score, numbers.Real) for score in row) for row in table):
+            raise ValueError("The table of %s must be 8 rows of 8 numbers" % piece)
+        piecePositionScores[piece] = table
+    return pieceScore, Evaluation.buildPieceSquareScores(pieceScore, piecePositionScores)
+
+
+def loadOpenings(path):
+    """
+    The start positions of an openings file, one FEN or EPD per line, lines starting with # are skipped
+    """
+    openings = []
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+                openings.append(" ".join(fields[:6]))
+            else:  # EPD: the four position fields and then operations
+                openings.append(" ".join(fields[:4]) + " 0 1")
+    return openings
+
+
+def optionAttribute(name):
+    """
+    (module, attribute) an option sets, ValueError if there is no such attribute or setting it would have no effect
+    """
+    moduleName, attribute = name.rsplit(".", 1) if "." in name else ("SmartMoveFinnder", name)
+    try:
+        module = importlib.import_module(moduleName)
+    except ImportError:
+        raise ValueError("Option %s: there is no module %s" % (name, moduleName)) from None
+    if not hasattr(module, attribute):
+        raise ValueError("Option %s: %s has no attribute %s" % (name, moduleName, attribute))
+    if attribute in FIXED_ATTRIBUTES:
+        raise ValueError("Option %s would have no effect, set %s instead" % (name, FIXED_ATTRIBUTES[attribute]))
+    return module, attribute
+
+
+def applyOptions(options):
+    """
+    Set module attributes for an engine, returns what is needed to restore them
+    """
+    saved = []
+    for name, value in options.items():
+        module, attribute = optionAttribute(name)
+        saved.append((module, attribute, getattr(module, attribute)))
+        setattr(module, attribute, value)
+    return saved
+
+
+def restoreOptions(saved):
+    for module, attribute, value in reversed(saved):
+        setattr(module, attribute, value)
+
+
+def insufficientMaterial(gs):
+    """
+    Neither side can force mate: no pawns, rooks or queens and at most a minor piece each
+    """
+    pieces = [piece for row in gs.board for piece in row if piece != "--" and piece[1] != "K"]
+    return all(piece[1] in "BN" for piece in pieces) and len(pieces) == len({piece[0] for piece in pieces})
+
+
+def engineMove(gs, validMoves, config, searchState):
+    """
+    The move of an engine: its options are set and its own transposition table and move orderer are used, so the two
+    engines of a game don't share what they learned
+    """
+    saved = applyOptions(config["options"])
+    SmartMoveFinnder.transpositionTable, SmartMoveFinnder.moveOrderer = searchState
+    try:
+        move = SmartMoveFinnder.findBookMove(gs, validMoves) if config["book"] else None
+        if move is None:
+            move = SmartMoveFinnder.findTablebaseMove(gs, validMoves)
+        if move is None:
+            move, iterations = SmartMoveFinnder.searchPosition(gs, validMoves, config["maxTime"], config["maxNodes"],
+                                                               config["maxDepth"])
+        return move
+    finally:
+        restoreOptions(saved)
+
+
+def playGame(job):
+    """
+    Play one game in a pool process, returns its record for the results file
+    """
+    gameIndex, fen, engine1, engine2 = job
+    engine1White = gameIndex % 2 == 0  # the games of an opening are played in pairs with the colors swapped
+    white, black = (engine1, engine2) if engine1White else (engine2, engine1)
+    searchStates = {"w": (TranspositionTable(white["hashMB"]), MoveOrderer()),
+                    "b": (TranspositionTable(black["hashMB"]), MoveOrderer())}
+    # a game state for each engine, both play every move, so each keeps the running scores of its own evaluation
+    gameStates = {}
+    for color, config in (("w", white), ("b", black)):
+        gameStates[color] = GameState.from_fen(fen)
+        evaluation = buildEvaluation(config["evaluation"])
+        if evaluation is not None:
+            gameStates[color].setEvaluation(*evaluation)
+    gs = gameStates["w"]  # the game is adjudicated on this one
+    positionCounts = {gs.zobristKey: 1}
+    moves = []
+    while True:
+        validMoves = gs.getValidMoves()
+        if gs.checkmate:
+            result, reason = ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+        elif gs.stalemate:
+            result, reason = "1/2-1/2", "stalemate"
+        elif gs.halfmoveClock >= 100:
+            result, reason = "1/2-1/2", "fifty moves"
+        elif positionCounts[gs.zobristKey] >= 3:
+            result, reason = "1/2-1/2", "repetition"
+        elif insufficientMaterial(gs):
+            result, reason = "1/2-1/2", "insufficient material"
+        elif len(moves) >= MAX_PLIES:
+            result, reason = "1/2-1/2", "move limit"
+        else:
+            color = "w" if gs.whiteToMove else "b"
+            engineState = gameStates[color]
+            move = engineMove(engineState, engineState.getValidMoves(), white if color == "w" else black,
+                              searchStates[color])
+            for state in gameStates.values():
+                state.makeMove(move if state is engineState else state.getMoveFromID(move.moveID))
+            moves.append(move.getChessNotation())
+            positionCounts[gs.zobristKey] = positionCounts.get(gs.zobristKey, 0) + 1
+            continue
+        break
+    engine1Score = RESULT_SCORES[result] if engine1White else 1 - RESULT_SCORES[result]
+    return {"game": gameIndex, "opening": fen, "white": white["name"], "black": black["name"], "result": result,
+            "reason": reason, "engine1Score": engine1Score, "plies": len(moves), "moves": moves}
+
+
+def initWorker():
+    SmartMoveFinnder.verbose = False
+    random.seed()  # searchPosition shuffles the root moves, forked workers would all start from the same state
+
+
+def eloFromScore(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+
+def scoreFromElo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def matchStats(wins, draws, losses, elo0, elo1):
+    """
+    Elo difference of engine1 with its 95% error, and the log likelihood ratio of the SPRT of elo1 against elo0
+    (normal approximation of the game scores)
+    """
+    games = wins + draws + losses
+    if not games:
+        return {"elo": 0.0, "eloError": math.inf, "llr": 0.0}
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    eloError = (eloFromScore(min(1.0, score + margin)) - eloFromScore(max(0.0, score - margin))) / 2 \
+        if 0 < score < 1 else math.inf
+    llr = 0.0
+    if variance > 0:
+        score0, score1 = scoreFromElo(elo0), scoreFromElo(elo1)
+        llr = games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+    return {"elo": eloFromScore(score), "eloError": eloError, "llr": llr}
+
+
+def sprtBounds(alpha, beta):
+    """
+    (lower, upper): the SPRT accepts elo0 once the log likelihood ratio falls to lower and elo1 once it reaches upper
+    """
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def loadResults(path):
+    """
+    The game records already in a results file, a line cut off by an interrupted run is skipped
+    """
+    results = {}
+    if os.path.exists(path):
+        with open(path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                results[record["game"]] = record
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Self-play match between two engine configurations")
+    parser.add_argument("--engine1", default="", help="JSON configuration of the engine under test")
+    parser.add_argument("--engine2", default="", help="JSON configuration of the reference engine")
+    parser.add_argument("--openings", help="file with one start position per line (default: the start position)")
+    parser.add_argument("--games", type=int, default=1000, help="games to play, 2 per opening")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="games played at the same time")
+    parser.add_argument("--output", default="match.jsonl", help="results file, an existing one is resumed")
+    parser.add_argument("--elo0", type=float, default=0.0, help="Elo difference of the SPRT null hypothesis")
+    parser.add_argument("--elo1", type=float, default=5.0, help="Elo difference of the SPRT alternative hypothesis")
+    parser.add_argument("--alpha", type=float, default=0.05, help="SPRT false positive rate")
+    parser.add_argument("--beta", type=float, default=0.05, help="SPRT false negative rate")
+    args = parser.parse_args()
+    try:
+        engine1 = loadConfig(args.engine1, "engine1")
+        engine2 = loadConfig(args.engine2, "engine2")
+    except ValueError as error:
+        parser.error(str(error))
+    openings = loadOpenings(args.openings) if args.openings else [START_FEN]
+    if not openings:
+        parser.error("No positions in " + args.openings)
+
+    results = loadResults(args.output)
+    counts = {1.0: 0, 0.5: 0, 0.0: 0}  # engine1 wins, draws and losses
+    for record in results.values():
+        counts[record["engine1Score"]] += 1
+    lower, upper = sprtBounds(args.alpha, args.beta)
+
+    def report():
+        stats = matchStats(counts[1.0], counts[0.5], counts[0.0], args.elo0, args.elo1)
+        print("%d/%d games: %s vs %s +%d =%d -%d  Elo %.1f +- %.1f  LLR %.2f (%.2f, %.2f)" % (
+            sum(counts.values()), args.games, engine1["name"], engine2["name"], counts[1.0], counts[0.5],
+            counts[0.0], stats["elo"], stats["eloError"], stats["llr"], lower, upper))
+        return stats["llr"]
+
+    if results:
+        print("resuming with %d games from %s" % (len(results), args.output))
+    llr = report()
+    jobs = [(gameIndex, openings[gameIndex // 2 % len(openings)], engine1, engine2)
+            for gameIndex in range(args.games) if gameIndex not in results]
+    if jobs and lower < llr < upper:
+        with Pool(args.processes, initializer=initWorker) as pool, open(args.output, "a") as output:
+            for record in pool.imap_unordered(playGame, jobs):
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                counts[record["engine1Score"]] += 1
+                llr = report()
+                if not lower < llr < upper:
+                    break  # leaving the with block stops the games still running
+    if llr >= upper:
+        print("SPRT passed: %s is stronger by at least %g Elo" % (engine1["name"], args.elo1))
+    elif llr <= lower:
+        print("SPRT failed: %s is not stronger by %g Elo" % (engine1["name"], args.elo1))
+    else:
+        print("SPRT inconclusive")
+
+
+if __name__ == "__main__":
+    main()
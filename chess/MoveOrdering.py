@@ -0,0 +1,136 @@
+"""
+Move ordering for the alpha-beta search. The better the first moves searched at a node, the more of the remaining
+moves get pruned, so moves are sorted in stages:
+hash move, captures by MVV-LVA (most valuable victim, least valuable attacker), promotions, killer moves and finally
+quiet moves by their history score.
+"""
+
+from TranspositionTable import NO_MOVE
+
+MAX_PLY = 128
+# piece values used for ordering captures only, the king is the least wanted attacker
+ORDERING_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}
+
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+PROMOTION_SCORE = 90000
+KILLER_SCORES = (80000, 79000)  # the history scores are kept below these
+
+
+def captureScore(move):
+    """
+    Captures by MVV-LVA, promotions without a capture after them, queen promotions before the underpromotions
+    """
+    score = ORDERING_VALUES[move.promotionPiece] if move.pawnPromotion else 0
+    if move.isCapture:
+        return CAPTURE_SCORE + 10 * ORDERING_VALUES[move.pieceCaptured[1]] - ORDERING_VALUES[move.pieceMoved[1]] + score
+    return PROMOTION_SCORE + score
+
+
+class MoveOrderer:
+
+    def __init__(self):
+        self.killers = [[NO_MOVE, NO_MOVE] for _ in range(MAX_PLY)]
+        self.history = {color + piece: [0] * 64 for color in "wb" for piece in "pNBRQK"}
+        self.resetStats()
+
+    def resetStats(self):
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0  # cutoffs caused by the first move searched, a measure of the ordering quality
+
+    def newSearch(self):
+        """
+        Killers are position specific so they are dropped, the history is only aged so it still helps the next search
+        """
+        for killers in self.killers:
+            killers[0] = killers[1] = NO_MOVE
+        for scores in self.history.values():
+            for sq in range(64):
+                scores[sq] //= 8
+        self.resetStats()
+
+    def orderMoves(self, moves, ply, hashMoveID=NO_MOVE):
+        """
+        Sort the moves in place, most promising first
+        """
+        killer1, killer2 = self.killers[ply] if ply < MAX_PLY else (NO_MOVE, NO_MOVE)
+        history = self.history
+
+        def moveScore(move):
+            if move.moveID == hashMoveID:
+                return HASH_MOVE_SCORE
+            if move.isCapture or move.pawnPromotion:
+                return captureScore(move)
+            if move.moveID == killer1:
+                return KILLER_SCORES[0]
+            if move.moveID == killer2:
+                return KILLER_SCORES[1]
+            return history[move.pieceMoved][move.endRow * 8 + move.endCol]
+
+        moves.sort(key=moveScore, reverse=True)
+        return moves
+
+    def orderedMoves(self, gs, pinsAndChecks, ply, hashMoveID=NO_MOVE, capturesOnly=False):
+        """
+        Yield the legal moves of the position stage by stage: the hash move, captures and promotions, the killers and
+        then the quiet moves by history. Every stage is only generated when the previous ones did not cause a cutoff,
+        and a move is only checked for legality right before it is yielded.
+        pinsAndChecks is gs.checkForPinsAndChecks() for the position. In check the few evasions are generated at once.
+        """
+        if pinsAndChecks[0] and not capturesOnly:
+            yield from self.orderMoves(gs.getCheckEvasions(pinsAndChecks), ply, hashMoveID)
+            return
+        if hashMoveID != NO_MOVE:
+            hashMove = gs.getMoveFromID(hashMoveID)
+            if hashMove is not None and (not capturesOnly or hashMove.isCapture or hashMove.pawnPromotion) and \
+                    gs.isLegalMove(hashMove, pinsAndChecks):
+                yield hashMove
+
+        captures = list(gs.generatePseudoLegalMoves(True))
+        captures.sort(key=captureScore, reverse=True)
+        for move in captures:
+            if move.moveID != hashMoveID and gs.isLegalMove(move, pinsAndChecks):
+                yield move
+        if capturesOnly:
+            return
+
+        killers = tuple(self.killers[ply]) if ply < MAX_PLY else (NO_MOVE, NO_MOVE)
+        for killerID in killers:
+            if killerID != NO_MOVE and killerID != hashMoveID:
+                killer = gs.getMoveFromID(killerID)
+                if killer is not None and not killer.isCapture and not killer.pawnPromotion and \
+                        gs.isLegalMove(killer, pinsAndChecks):
+                    yield killer
+
+        history = self.history
+        quietMoves = list(gs.generatePseudoLegalMoves(False))
+        quietMoves.sort(key=lambda quietMove: history[quietMove.pieceMoved][quietMove.endRow * 8 + quietMove.endCol],
+                        reverse=True)
+        for move in quietMoves:
+            if move.moveID != hashMoveID and move.moveID not in killers and gs.isLegalMove(move, pinsAndChecks):
+                yield move
+
+    def recordCutoff(self, move, ply, depth, moveNumber):
+        """
+        Remember a move that caused a beta cutoff, quiet moves become killers and gain history
+        """
+        self.cutoffs += 1
+        if moveNumber == 0:
+            self.firstMoveCutoffs += 1
+        if move.isCapture or move.pawnPromotion:
+            return  # already ordered early
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move.moveID:
+                killers[1] = killers[0]
+                killers[0] = move.moveID
+        scores = self.history[move.pieceMoved]
+        endSq = move.endRow * 8 + move.endCol
+        scores[endSq] += depth * depth
+        if scores[endSq] >= KILLER_SCORES[1]:  # keep history scores below the killers
+            for sq in range(64):
+                scores[sq] //= 2
+
+    def stats(self):
+        return "cutoffs %d first move cutoffs %.1f%%" % (
+            self.cutoffs, 100 * self.firstMoveCutoffs / self.cutoffs if self.cutoffs else 0)
@@ -0,0 +1,104 @@
+"""
+Polyglot opening book. A .bin book is an array of 16 byte big endian entries (key, move, weight, learn) sorted by
+the position key, so the file is mapped into memory and binary searched: a book of any size opens instantly and only
+the pages that are looked at are ever read.
+"""
+
+import mmap
+import random
+import struct
+
+from PolyglotRandom import POLYGLOT_RANDOM
+
+ENTRY = struct.Struct(">QHHI")  # key, move, weight, learn
+KEY = struct.Struct(">Q")
+# piece kind of the Polyglot key, black before white for every piece type
+POLYGLOT_PIECE_KINDS = {"bp": 0, "wp": 1, "bN": 2, "wN": 3, "bB": 4, "wB": 5,
+                        "bR": 6, "wR": 7, "bQ": 8, "wQ": 9, "bK": 10, "wK": 11}
+POLYGLOT_CASTLING = 768  # + the castling right, the bits of GameState.castlingRights are in the same order
+POLYGLOT_EN_PASSANT = 772  # + the file
+POLYGLOT_WHITE_TO_MOVE = 780
+PROMOTION_PIECES = (None, "N", "B", "R", "Q")  # indexed by the promotion field of a book move
+
+
+def polyglotKey(gs):
+    """
+    The Polyglot key of the position, it is not the zobrist key of the game state since the book format fixes its
+    own random numbers
+    """
+    key = 0
+    for r, row in enumerate(gs.board):
+        for c, piece in enumerate(row):
+            if piece != "--":
+                key ^= POLYGLOT_RANDOM[64 * POLYGLOT_PIECE_KINDS[piece] + 8 * (7 - r) + c]
+    for right in range(4):
+        if gs.castlingRights & (1 << right):
+            key ^= POLYGLOT_RANDOM[POLYGLOT_CASTLING + right]
+    # the en passant file only counts if a pawn of the side to move stands next to the pawn that can be taken
+    if gs.enPassantPossible != ():
+        endRow, endCol = gs.enPassantPossible
+        pawnRow, pawn = (endRow + 1, "wp") if gs.whiteToMove else (endRow - 1, "bp")
+        if any(0 <= c < 8 and gs.board[pawnRow][c] == pawn for c in (endCol - 1, endCol + 1)):
+            key ^= POLYGLOT_RANDOM[POLYGLOT_EN_PASSANT + endCol]
+    if gs.whiteToMove:
+        key ^= POLYGLOT_RANDOM[POLYGLOT_WHITE_TO_MOVE]
+    return key
+
+
+class OpeningBook:
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            # the mapping stays valid after the file is closed
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entryCount = len(self.map) // ENTRY.size
+
+    def entries(self, key):
+        """
+        Yield (move, weight) of every book entry of the position key
+        """
+        low, high = 0, self.entryCount
+        while low < high:  # first entry with a key not below the one looked for
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        for index in range(low, self.entryCount):
+            entryKey, move, weight, learn = ENTRY.unpack_from(self.map, index * ENTRY.size)
+            if entryKey != key:
+                break
+            yield move, weight
+
+    def getMoves(self, gs, validMoves):
+        """
+        The book moves of the position as (move out of validMoves, weight)
+        """
+        bookMoves = []
+        for bookMove, weight in self.entries(polyglotKey(gs)):
+            startRow, startCol = 7 - (bookMove >> 9 & 7), bookMove >> 6 & 7
+            endRow, endCol = 7 - (bookMove >> 3 & 7), bookMove & 7
+            promotionPiece = PROMOTION_PIECES[bookMove >> 12 & 7]
+            if gs.board[startRow][startCol][1] == "K" and abs(endCol - startCol) > 1:
+                endCol = 6 if endCol > startCol else 2  # castling is written as the king taking its own rook
+            for move in validMoves:
+                if move.startRow == startRow and move.startCol == startCol and move.endRow == endRow and \
+                        move.endCol == endCol and (not move.pawnPromotion or move.promotionPiece == promotionPiece):
+                    bookMoves.append((move, weight))
+                    break
+        return bookMoves
+
+    def chooseMove(self, gs, validMoves, maxPly=None, rng=random):
+        """
+        A book move picked at random in proportion to the entry weights, None when the position is not in the book or
+        the game is past maxPly plies
+        """
+        if maxPly is not None and 2 * (gs.fullmoveNumber - 1) + (not gs.whiteToMove) >= maxPly:
+            return None
+        bookMoves = [(move, weight) for move, weight in self.getMoves(gs, validMoves) if weight > 0]
+        if not bookMoves:
+            return None
+        return rng.choices([move for move, weight in bookMoves], [weight for move, weight in bookMoves])[0]
+
+    def close(self):
+        self.map.close()
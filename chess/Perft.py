@@ -0,0 +1,191 @@
+"""
+Perft (performance test) for the move generator. It counts the leaf nodes of the legal move tree down to a fixed
+depth, those counts are known for a set of standard positions so any generator bug shows up as a wrong number.
+The same walk is used as a repeatable benchmark of the generator speed.
+
+Usage (from the chess folder):
+    python Perft.py "<fen>" <depth> [--divide]     count one position, --divide splits the count by root move
+    python Perft.py --suite [--max-nodes N]         check all the positions in PERFT_SUITE
+    python Perft.py --bench [--max-nodes N]         nodes per second of every generator over the suite
+    python Perft.py --make-undo                     makeMove/undoMove pairs per second over the suite positions
+--lazy uses the staged generator the search uses (generatePseudoLegalMoves + isLegalMove) instead of getValidMoves.
+"""
+
+import argparse
+import sys
+import time
+
+from ChessEngine import GameState, START_FEN
+
+# (name, fen, leaf counts for depth 1, 2, 3, ...)
+PERFT_SUITE = [
+    ("initial position", START_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("en passant and rook checks", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("promotions and castling", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotions and castling, mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("promotion with capture", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+    ("illegal en passant, pinned on the row", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     [18, 92, 1670, 10138, 185429, 1134888]),
+    ("illegal en passant, pinned on the diagonal", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     [13, 102, 1266, 10276, 135655, 1015133]),
+    ("en passant capture gives check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", [15, 126, 1928, 13931, 206379, 1440467]),
+    ("short castling gives check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", [15, 66, 1198, 6399, 120330, 661072]),
+    ("long castling gives check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", [16, 71, 1286, 7418, 141077, 803711]),
+    ("castling rights lost by captures", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", [26, 1141, 27826, 1274206]),
+    ("castling through check", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", [44, 1494, 50509, 1720476]),
+    ("castling past a pawn attack", "r3k2r/8/8/8/8/8/3p4/R3K2R w KQkq - 0 1", [5, 142, 3316, 88669, 2040273]),
+    ("promote out of check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", [11, 133, 1442, 19174, 266199, 3821001]),
+    ("discovered check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", [29, 165, 5160, 31961, 1004658]),
+    ("promote to give check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", [9, 40, 472, 2661, 38983, 217342, 3742283]),
+    ("underpromote to give check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", [6, 27, 273, 1329, 18135, 92683]),
+    ("self stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", [2, 6, 13, 63, 382, 2217, 15453]),
+    ("stalemate and checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("double check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", [37, 183, 6559, 23527, 811573]),
+    ("promotions for both sides", "n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1", [24, 496, 9483, 182838, 3605103]),
+]
+
+
+def getLegalMoves(gs, lazy=False):
+    if lazy:
+        pinsAndChecks = gs.checkForPinsAndChecks()
+        return [move for captures in (True, False) for move in gs.generatePseudoLegalMoves(captures)
+                if gs.isLegalMove(move, pinsAndChecks)]
+    return gs.getValidMoves()
+
+
+def perft(gs, depth, lazy=False):
+    """
+    Number of leaf nodes of the legal move tree depth plies deep, the last ply is counted without making the moves
+    """
+    if depth == 0:
+        return 1
+    moves = getLegalMoves(gs, lazy)
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, lazy)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth, lazy=False):
+    """
+    Perft split by root move, returns a list of (move, nodes)
+    """
+    counts = []
+    for move in getLegalMoves(gs, lazy):
+        gs.makeMove(move)
+        counts.append((move.getChessNotation(), perft(gs, depth - 1, lazy)))
+        gs.undoMove()
+    return counts
+
+
+def runSuite(gameStateClass=GameState, lazy=False, maxNodes=100000):
+    """
+    Check every suite position to the deepest depth with at most maxNodes leaves, returns True if all counts match
+    """
+    failures = 0
+    for name, fen, counts in PERFT_SUITE:
+        passedDepth = 0
+        for depth, expected in enumerate(counts, 1):
+            if depth > 1 and expected > maxNodes:
+                break
+            nodes = perft(gameStateClass.from_fen(fen), depth, lazy)
+            if nodes != expected:
+                print("FAIL %s depth %d: %d instead of %d  (%s)" % (name, depth, nodes, expected, fen))
+                break
+            passedDepth = depth
+        else:
+            passedDepth = len(counts)
+        if passedDepth == len(counts) or (passedDepth > 0 and counts[passedDepth] > maxNodes):
+            print("ok   %s up to depth %d" % (name, passedDepth))
+        else:
+            failures += 1
+    print("%d of %d positions failed" % (failures, len(PERFT_SUITE)))
+    return failures == 0
+
+
+def runBenchmark(gameStateClass=GameState, lazy=False, maxNodes=100000):
+    """
+    Perft every suite position to the deepest depth with at most maxNodes leaves and report the leaf nodes per second
+    """
+    totalNodes = 0
+    start = time.perf_counter()
+    for name, fen, counts in PERFT_SUITE:
+        depth = max([1] + [d for d, expected in enumerate(counts, 1) if expected <= maxNodes])
+        totalNodes += perft(gameStateClass.from_fen(fen), depth, lazy)
+    elapsed = time.perf_counter() - start
+    print("%-18s %-14s %9d nodes %7.2fs %9.0f nodes/s" % (gameStateClass.__name__, "lazy" if lazy else "getValidMoves",
+                                                         totalNodes, elapsed, totalNodes / elapsed))
+    return totalNodes / elapsed
+
+
+def runMakeUndoBenchmark(gameStateClass=GameState, rounds=100, repeats=5):
+    """
+    Make and undo every legal move of every suite position rounds times and report the pairs per second, the best
+    of repeats runs is taken so other work on the machine does not count
+    """
+    positions = []
+    for name, fen, counts in PERFT_SUITE:
+        gs = gameStateClass.from_fen(fen)
+        positions.append((gs, gs.getValidMoves()))
+    pairs = rounds * sum(len(moves) for gs, moves in positions)
+    elapsed = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for gs, moves in positions:
+                for move in moves:
+                    gs.makeMove(move)
+                    gs.undoMove()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print("%-18s make/undo %9d pairs %7.2fs %9.0f pairs/s" % (gameStateClass.__name__, pairs, elapsed,
+                                                                pairs / elapsed))
+    return pairs / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perft and move generator benchmark")
+    parser.add_argument("fen", nargs="?", default=START_FEN)
+    parser.add_argument("depth", nargs="?", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="split the count by root move")
+    parser.add_argument("--suite", action="store_true", help="check the bundled positions")
+    parser.add_argument("--bench", action="store_true", help="report nodes/sec over the bundled positions")
+    parser.add_argument("--make-undo", action="store_true", help="report makeMove/undoMove pairs/sec")
+    parser.add_argument("--max-nodes", type=int, default=100000, help="deepest suite depth to run, by leaf count")
+    parser.add_argument("--lazy", action="store_true", help="use the staged generator of the search")
+    args = parser.parse_args()
+
+    if args.suite:
+        sys.exit(0 if runSuite(GameState, args.lazy, args.max_nodes) else 1)
+    if args.make_undo:
+        runMakeUndoBenchmark(GameState)
+        return
+    if args.bench:
+        for lazy in ([True] if args.lazy else [False, True]):
+            runBenchmark(GameState, lazy, args.max_nodes)
+        return
+
+    gs = GameState.from_fen(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(gs, args.depth, args.lazy)
+        for notation, nodes in sorted(counts):
+            print("%s: %d" % (notation, nodes))
+        nodes = sum(nodes for notation, nodes in counts)
+        print("moves: %d" % len(counts))
+    else:
+        nodes = perft(gs, args.depth, args.lazy)
+    elapsed = time.perf_counter() - start
+    print("nodes: %d  time: %.2fs  %.0f nodes/s" % (nodes, elapsed, nodes / elapsed if elapsed else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,69 @@
+import os
+import queue
 import random
+import time
+from multiprocessing import Event, Process, Queue
 
-pieceScore = {"K": 0, "Q": 10, "R": 5, "B": 3, "N": 3, "p": 1}
-knightScores = [[1, 1, 1, 1, 1, 1, 1, 1],
-                [1, 2, 2, 2, 2, 2, 2, 1],
-                [1, 2, 3, 3, 3, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 3, 3, 3, 2, 1],
-                [1, 2, 2, 2, 2, 2, 2, 1],
-                [1, 1, 1, 1, 1, 1, 1, 1]]
-
-bishopScores = [[4, 3, 2, 1, 1, 2, 3, 4],
-                [3, 4, 3, 2, 2, 3, 4, 3],
-                [2, 3, 4, 3, 3, 4, 3, 2],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [1, 2, 3, 4, 4, 3, 2, 1],
-                [2, 3, 4, 3, 3, 4, 3, 2],
-                [3, 4, 3, 2, 2, 3, 4, 3],
-                [4, 3, 2, 1, 1, 2, 3, 4]]
-
-queenScores = [[1, 1, 1, 3, 1, 1, 1, 1],
-               [1, 2, 3, 3, 3, 1, 1, 1],
-               [1, 4, 3, 3, 3, 4, 2, 1],
-               [1, 2, 3, 3, 3, 2, 2, 1],
-               [1, 2, 3, 3, 3, 2, 2, 1],
-               [1, 4, 3, 3, 3, 4, 2, 1],
-               [1, 1, 2, 3, 3, 1, 1, 1],
-               [1, 1, 1, 3, 1, 1, 1, 1]]
-# probably better to try to place rooks on open files, or on same as other rook/queen
-
-rookScores = [[4, 3, 4, 4, 4, 4, 3, 4],
-              [4, 4, 4, 4, 4, 4, 4, 4],
-              [1, 1, 2, 3, 3, 2, 1, 1],
-              [1, 2, 3, 4, 4, 3, 2, 1],
-              [1, 2, 3, 4, 4, 3, 2, 1],
-              [1, 1, 2, 2, 2, 2, 1, 1],
-              [4, 4, 4, 4, 4, 4, 4, 4],
-              [4, 3, 4, 4, 4, 4, 3, 4]]
-
-whitePawnScores = [[8, 8, 8, 8, 8, 8, 8, 8],
-                   [8, 8, 8, 8, 8, 8, 8, 8],
-                   [5, 6, 6, 7, 7, 6, 6, 5],
-                   [1, 3, 3, 5, 5, 3, 3, 2],
-                   [1, 2, 3, 4, 4, 3, 2, 1],
-                   [1, 1, 2, 3, 3, 2, 1, 1],
-                   [1, 1, 1, 0, 0, 1, 1, 1],
-                   [0, 0, 0, 0, 0, 0, 0, 0]]
-
-blackPawnScores = [[0, 0, 0, 0, 0, 0, 0, 0],
-                   [1, 1, 1, 0, 0, 1, 1, 1],
-                   [1, 1, 2, 3, 3, 2, 1, 1],
-                   [1, 2, 3, 4, 4, 3, 2, 1],
-                   [2, 3, 3, 5, 5, 3, 3, 1],
-                   [5, 6, 6, 7, 7, 6, 6, 5],
-                   [8, 8, 8, 8, 8, 8, 8, 8],
-                   [8, 8, 8, 8, 8, 8, 8, 8]]
-
-piecePositionScores = {"N": knightScores, "Q": queenScores, "B": bishopScores, "R": rookScores,
-                       "bp": blackPawnScores, "wp": whitePawnScores}
-CHECKMATE = 1000
+from Evaluation import pieceScore, piecePositionScores
+from MoveOrdering import MoveOrderer, MAX_PLY
+from OpeningBook import OpeningBook
+from Tablebase import Tablebases
+from TranspositionTable import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND, NO_MOVE
+
+CHECKMATE = 1000  # score of mating at the root, a mate ply plies away scores CHECKMATE - ply
 STALEMATE = 0
-DEPTH = 3
-global nextMove, counter
+seeScore = dict(pieceScore, K=CHECKMATE)  # piece values for exchanges, losing the king ends them
+DELTA_MARGIN = 2  # a capture that can't raise the score to alpha even with this bonus is not searched in quiescence
+USE_SEE_PRUNING = True  # skip captures in quiescence that lose material according to the static exchange evaluation
+QUIESCENCE_CHECK_PLIES = 4  # quiescence plies in which all evasions are searched when in check
+MAX_DEPTH = 64  # iterative deepening stops here even if there is time left
+THINK_TIME = 2.0  # default time budget per move in seconds
+LIMIT_CHECK_INTERVAL = 256  # nodes between two checks of the clock and the node budget
+HASH_SIZE_MB = 16  # memory budget of the transposition table
+SEARCH_PROCESSES = os.cpu_count() or 1  # processes searching one position together, 1 searches in this process only
+OPENING_BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")  # Polyglot book, if present
+BOOK_MAX_PLY = 20  # the book is only used for this many plies of the game
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")  # generated by Tablebase.py
+transpositionTable = TranspositionTable(HASH_SIZE_MB)  # kept between moves, older entries are aged out
+sharedTranspositionTable = None  # shared memory table of the parallel search, also kept between moves
+searchHelpers = None  # the SearchHelpers of the parallel search, also kept between moves
+moveOrderer = MoveOrderer()
+openingBook = None  # mapped on first use and kept open
+tablebases = None  # the endgame tables, mapped on first use like the book
+stopEvent = None  # set by another process to stop the search early
+verbose = True  # print the search progress
+reportIteration = None  # called with the report of every completed iteration, e.g. to stream UCI info lines
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time or node budget runs out
+    """
+
+
+class SearchContext:
+    """
+    The state of one search passed down the tree: nodes counted so far, the depth of the iteration at the root, the
+    best root move found in it and the limits that stop the search
+    """
+    __slots__ = ("nodes", "rootDepth", "bestMove", "deadline", "nodeLimit")
+
+    def __init__(self):
+        self.nodes = 0
+        self.rootDepth = 0
+        self.bestMove = None
+        self.deadline = None  # time.perf_counter() value
+        self.nodeLimit = None
+
+    def checkLimits(self):
+        """
+        Stop the search by raising SearchTimeout once the clock or the node budget has run out or the search is
+        stopped from another process
+        """
+        if (self.deadline is not None and time.perf_counter() >= self.deadline) or \
+                (self.nodeLimit is not None and self.nodes >= self.nodeLimit) or \
+                (stopEvent is not None and stopEvent.is_set()):
+            raise SearchTimeout()
 
 
 def findRandomMove(validMoves):
@@ -110,29 +112,375 @@ def findGreedyMove(gs, validMoves):
     return bestPlayerMove
 
 
-def findBestMove(gs, validMoves, returnQueue):
+def findBestMove(gs, validMoves, returnQueue, maxTime=THINK_TIME, maxNodes=None, maxDepth=MAX_DEPTH,
+                 processes=SEARCH_PROCESSES):
     """
     Helper method to make first recursive call
     """
-    global nextMove, counter
-    nextMove = None
-    random.shuffle(validMoves)
-    counter = 0
-    # findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
+    bookMove = findBookMove(gs, validMoves)
+    if bookMove is not None:
+        returnQueue.put(bookMove)
+        return
+    tablebaseMove = findTablebaseMove(gs, validMoves)
+    if tablebaseMove is not None:
+        returnQueue.put(tablebaseMove)
+        return
+    if processes > 1:
+        bestMove, iterations = parallelSearch(gs, validMoves, maxTime, maxNodes, maxDepth, processes)
+        closeSharedTable()  # findBestMove runs in a process of its own for every move
+    else:
+        bestMove, iterations = searchPosition(gs, validMoves, maxTime, maxNodes, maxDepth)
+    returnQueue.put(bestMove)
 
-    # findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
 
-    # alpha starting with the lowest possible score and beta starting with the highest possible score, and when they
-    # cross each other we break out of our method.
+def findBookMove(gs, validMoves):
+    """
+    A move from the opening book, None when there is no book or the position is not in it
+    """
+    global openingBook
+    if openingBook is None:
+        if not OPENING_BOOK_PATH or not os.path.exists(OPENING_BOOK_PATH):
+            return None
+        openingBook = OpeningBook(OPENING_BOOK_PATH)
+    bookMove = openingBook.chooseMove(gs, validMoves, BOOK_MAX_PLY)
+    if bookMove is not None and verbose:
+        print("book move", bookMove)
+    return bookMove
+
+
+def probeTablebases(gs, ply=0):
+    """
+    Score of the position for the side to move from the endgame tables, None if the position is not in them. The
+    tables know the distance to mate, so a won position scores as the mate ply plies from the root plus that distance.
+    """
+    global tablebases
+    if tablebases is None:
+        tablebases = Tablebases(TABLEBASE_PATH)  # a missing folder just has no tables
+    result = tablebases.probe(gs)
+    if result is None:
+        return None
+    outcome, plies = result
+    return outcome * (CHECKMATE - ply - plies)
+
+
+def findTablebaseMove(gs, validMoves):
+    """
+    The move that mates fastest, or draws, or gets mated slowest according to the endgame tables, None when the
+    position is not in them
+    """
+    if (gs.materialScore["w"] and gs.materialScore["b"]) or not validMoves or probeTablebases(gs) is None:
+        return None
+    bestMove, bestScore = None, None
+    for move in validMoves:
+        gs.makeMove(move)
+        score = probeTablebases(gs, 1)
+        gs.undoMove()
+        score = STALEMATE if score is None else -score  # only under-promotions leave the tables, to a lone minor piece
+        if bestScore is None or score > bestScore:
+            bestMove, bestScore = move, score
+    if verbose:
+        print("tablebase move", bestMove, bestScore)
+    return bestMove
+
+
+def parallelSearch(gs, validMoves, maxTime=THINK_TIME, maxNodes=None, maxDepth=MAX_DEPTH, processes=SEARCH_PROCESSES):
+    """
+    Lazy SMP: this process and processes - 1 helper processes all search the same position with iterative deepening
+    and share one transposition table, so each one finds many positions already searched by the others. The root
+    moves are shuffled differently in every process and every other helper starts one ply deeper, so they spread out
+    over the tree. The helpers are stopped as soon as this process is done and the deepest completed iteration of all
+    of them wins. Returns the same as searchPosition, the "nodes" of the last report are those of all processes.
+    The helpers and the shared table are kept for the next parallel search until closeSharedTable is called.
+    """
+    global transpositionTable
+    if processes <= 1 or len(validMoves) <= 1:
+        return searchPosition(gs, validMoves, maxTime, maxNodes, maxDepth)
+    helpers = startSearchHelpers(processes, type(gs))
+    ownTable = transpositionTable
+    transpositionTable = sharedTranspositionTable
+    try:
+        helpers.go(gs, sharedTranspositionTable.age, maxTime, maxNodes, maxDepth)
+        context = SearchContext()
+        results = [searchPosition(gs, validMoves, maxTime, maxNodes, maxDepth, context=context) + (context.nodes,)]
+    finally:
+        helperResults = helpers.stop()
+        transpositionTable = ownTable
+
+    results += helperResults
+    totalNodes = sum(nodes for bestMove, iterations, nodes in results)
+    bestMove, iterations = results[0][:2]
+    for helperMove, helperIterations, nodes in results[1:]:
+        if helperIterations and (not iterations or (helperIterations[-1]["depth"], helperIterations[-1]["score"]) >
+                                 (iterations[-1]["depth"], iterations[-1]["score"])):
+            bestMove, iterations = helperMove, helperIterations
+    if iterations:
+        iterations[-1] = dict(iterations[-1], nodes=totalNodes)
+        if verbose:
+            print("%d processes: depth %d score %.2f nodes %d pv %s" % (
+                processes, iterations[-1]["depth"], iterations[-1]["score"], totalNodes,
+                " ".join(str(move) for move in iterations[-1]["pv"])))
+    # the move object has to come from our own move list to be made on our board
+    bestMove = next((move for move in validMoves if move == bestMove), validMoves[0])
+    return bestMove, iterations
+
+
+def startSearchHelpers(processes, gameStateClass):
+    """
+    The helper processes of a parallel search with processes processes in all, started once and kept running. The
+    engine process starts them with itself, so its first search doesn't wait for them.
+    """
+    global sharedTranspositionTable, searchHelpers
+    if searchHelpers is not None and (len(searchHelpers.processes) != processes - 1 or
+                                      searchHelpers.gameStateClass is not gameStateClass or not searchHelpers.alive()):
+        searchHelpers.close()
+        searchHelpers = None
+    if searchHelpers is None:
+        if sharedTranspositionTable is None:
+            sharedTranspositionTable = TranspositionTable(transpositionTable.sizeMB, shared=True)
+        searchHelpers = SearchHelpers(processes - 1, gameStateClass, sharedTranspositionTable)
+    return searchHelpers
+
+
+def closeSharedTable():
+    """
+    Stop the helper processes of the parallel search and free its transposition table
+    """
+    global sharedTranspositionTable, searchHelpers
+    if searchHelpers is not None:
+        searchHelpers.close()
+        searchHelpers = None
+    if sharedTranspositionTable is not None:
+        sharedTranspositionTable.close()
+        sharedTranspositionTable = None
+
+
+class SearchHelpers:
+    """
+    The helper processes of the parallel search. Each one keeps a game state of its own, so a search only sends them
+    the moves played or taken back since the last one and a go, and the stop event ends their search. Nothing is
+    pickled per search but those commands, where processes are spawned instead of forked a helper imports the modules
+    once when it starts.
+    """
+
+    def __init__(self, count, gameStateClass, sharedTable):
+        self.gameStateClass = gameStateClass
+        self.stopEvent = Event()
+        self.results = Queue()
+        self.commandQueues = [Queue() for _ in range(count)]
+        self.processes = [Process(target=helperLoop, args=(commands, self.results, sharedTable, self.stopEvent,
+                                                           helperIndex, gameStateClass), daemon=True)
+                          for helperIndex, commands in enumerate(self.commandQueues, 1)]
+        self.sentFen = None  # position and moves the helpers have been sent
+        self.sentMoveIDs = []
+        self.searchCount = 0
+        for process in self.processes:
+            process.start()
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def send(self, command):
+        for commands in self.commandQueues:
+            commands.put(command)
+
+    def go(self, gs, age, maxTime, maxNodes, maxDepth):
+        """
+        Start the helpers searching the position of gs, age is the age of the shared table before the search
+        """
+        commands, self.sentFen, self.sentMoveIDs = positionCommands(gs, self.sentFen, self.sentMoveIDs)
+        for command in commands:
+            self.send(command)
+        self.stopEvent.clear()
+        self.searchCount += 1
+        self.send(("go", self.searchCount, age, maxTime, maxNodes, maxDepth))
+
+    def stop(self):
+        """
+        Stop the search of the helpers, returns (bestMove, iterations, nodes) of every helper that reported
+        """
+        self.stopEvent.set()
+        results = []
+        while len(results) < len(self.processes):
+            try:
+                searchID, bestMove, iterations, nodes = self.results.get(timeout=0.1)
+            except queue.Empty:
+                if not self.alive() and self.results.empty():
+                    break  # a helper died without reporting, the next search starts new ones
+                continue
+            if searchID == self.searchCount:  # not a late result of a search that was given up on
+                results.append((bestMove, iterations, nodes))
+        return results
+
+    def close(self):
+        self.stopEvent.set()
+        self.send(("quit",))
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
+
+def helperLoop(commands, results, sharedTable, stop, helperIndex, gameStateClass):
+    """
+    Body of a Lazy SMP helper process: keeps its game state in step and searches quietly with the shared table on
+    every go
+    """
+    global transpositionTable, stopEvent, verbose, reportIteration
+    transpositionTable = sharedTable
+    stopEvent = stop
+    verbose = False
+    reportIteration = None
+    random.seed()  # a forked process starts with the same random state as its parent
+    gs = gameStateClass()
+    while True:
+        command = commands.get()
+        if applyPositionCommand(gs, command):
+            continue
+        if command[0] == "go":
+            searchID, age, maxTime, maxNodes, maxDepth = command[1:]
+            transpositionTable.age = age  # newSearch moves it on in step with the other processes
+            context = SearchContext()
+            bestMove, iterations = searchPosition(gs, gs.getValidMoves(), maxTime, maxNodes, maxDepth,
+                                                  1 + helperIndex % 2, context)
+            results.put((searchID, bestMove, iterations, context.nodes))
+        elif command[0] == "quit":
+            break
+    sharedTable.close()
+
 
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    print(counter)
-    returnQueue.put(nextMove)
+def positionCommands(gs, sentFen, sentMoveIDs):
+    """
+    Commands that bring a game state that was sent sentFen and the moves sentMoveIDs to the position of gs, for
+    applyPositionCommand in another process: only the moves taken back and played since are sent. Returns (commands,
+    sentFen, sentMoveIDs) with what has been sent after them.
+    """
+    commands = []
+    if gs.startFen != sentFen:
+        commands.append(("fen", gs.startFen))
+        sentMoveIDs = []
+    moveIDs = [move.moveID for move in gs.moveLog]
+    common = 0
+    while common < len(moveIDs) and common < len(sentMoveIDs) and moveIDs[common] == sentMoveIDs[common]:
+        common += 1
+    if len(sentMoveIDs) > common:
+        commands.append(("undo", len(sentMoveIDs) - common))
+    if len(moveIDs) > common:
+        commands.append(("moves", moveIDs[common:]))
+    return commands, gs.startFen, moveIDs
+
+
+def applyPositionCommand(gs, command):
+    """
+    Carry out a command of positionCommands on gs, returns False for any other command
+    """
+    if command[0] == "fen":
+        gs.loadFen(command[1])
+    elif command[0] == "moves":
+        for moveID in command[1]:
+            move = gs.getMoveFromID(moveID)
+            if move is None:
+                raise ValueError("Move %d can't be played in %s" % (moveID, gs.to_fen()))
+            gs.makeMove(move)
+    elif command[0] == "undo":
+        for _ in range(command[1]):
+            gs.undoMove()
+    else:
+        return False
+    return True
 
 
-def findMoveMinMax(gs, validMoves, depth, whiteToMove):
+def searchPosition(gs, validMoves, maxTime=THINK_TIME, maxNodes=None, maxDepth=MAX_DEPTH, firstDepth=1, context=None):
+    """
+    Iterative deepening from firstDepth to maxDepth until the time (seconds) or node budget runs out. Returns the best
+    move of the last completed iteration and a report (depth, score, nodes, time, move, principal variation) for every
+    completed iteration. Scores are from the point of view of the side to move. A SearchContext passed in is used
+    for the search, so its nodes count the interrupted last iteration too.
+    """
+    if len(validMoves) == 0:
+        return None, []
+    random.shuffle(validMoves)
+    startTime = time.perf_counter()
+    if context is None:
+        context = SearchContext()
+    context.nodes = 0
+    context.deadline = startTime + maxTime if maxTime is not None else None
+    context.nodeLimit = maxNodes
+    moveLogLength = len(gs.moveLog)
 
-    global nextMove
+    # alpha starting with the lowest possible score and beta starting with the highest possible score, and when they
+    # cross each other we break out of our method.
+    transpositionTable.newSearch()
+    transpositionTable.resetStats()
+    moveOrderer.newSearch()
+    bestMove = validMoves[0]  # in case not even depth 1 completes
+    iterations = []
+    previousIterationNodes = 0
+    for depth in range(min(firstDepth, maxDepth), maxDepth + 1):
+        iterationStartNodes = context.nodes
+        context.rootDepth = depth
+        context.bestMove = None
+        try:
+            score = findMoveNegaMaxAlphaBeta(gs, validMoves, depth, -CHECKMATE, CHECKMATE,
+                                             1 if gs.whiteToMove else -1, context)
+        except SearchTimeout:
+            while len(gs.moveLog) > moveLogLength:  # the search was interrupted in the middle of the tree
+                gs.undoMove()
+            break
+        elapsed = time.perf_counter() - startTime
+        if context.bestMove is not None:
+            bestMove = context.bestMove
+            # search the best move first in the next iteration
+            validMoves.remove(bestMove)
+            validMoves.insert(0, bestMove)
+        # effective branching factor: how many times more nodes this iteration needed than the previous one
+        iterationNodes = context.nodes - iterationStartNodes
+        branchingFactor = iterationNodes / previousIterationNodes if previousIterationNodes else 0.0
+        previousIterationNodes = iterationNodes
+        principalVariation = getPrincipalVariation(gs, bestMove, depth)
+        iterations.append({"depth": depth, "score": score, "nodes": context.nodes, "time": elapsed,
+                           "move": bestMove, "ebf": branchingFactor, "pv": principalVariation})
+        if reportIteration is not None:
+            reportIteration(iterations[-1])
+        if verbose:
+            print("depth %d score %.2f nodes %d time %.3fs ebf %.2f pv %s" % (
+                depth, score, context.nodes, elapsed, branchingFactor,
+                " ".join(str(move) for move in principalVariation)))
+        if isMateScore(score) or len(validMoves) <= 1:
+            break  # nothing left to find out
+        if maxTime is not None and elapsed > maxTime / 2:
+            break  # the next iteration takes longer than everything so far, it would not finish in time
+    if verbose:
+        print(transpositionTable.stats())
+        print(moveOrderer.stats())
+    return bestMove, iterations
+
+
+def getPrincipalVariation(gs, firstMove, maxLength):
+    """
+    The line the search expects: firstMove followed by the best moves stored in the transposition table
+    """
+    principalVariation = []
+    move = firstMove
+    while move is not None and len(principalVariation) < maxLength:
+        principalVariation.append(move)
+        gs.makeMove(move)
+        entry = transpositionTable.probe(gs.zobristKey)
+        move = None
+        if entry is not None and entry[3] != NO_MOVE:
+            move = gs.getMoveFromID(entry[3])
+            if move is not None and not gs.isLegalMove(move, gs.checkForPinsAndChecks()):
+                move = None
+    for _ in principalVariation:
+        gs.undoMove()
+    return principalVariation
+
+
+def findMoveMinMax(gs, validMoves, depth, whiteToMove, context, rootDepth=None):
+    """
+    rootDepth is the depth of the first call, where the best move is kept in context.bestMove
+    """
+    if rootDepth is None:
+        rootDepth = depth
     if depth == 0:  # evaluate
         return scoreMaterial(gs.board)
 
@@ -141,11 +489,11 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMoves, depth - 1, False)
+            score = findMoveMinMax(gs, nextMoves, depth - 1, False, context, rootDepth)
             if score > maxScore:
                 maxScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                if depth == rootDepth:
+                    context.bestMove = move
             gs.undoMove()
         return maxScore
 
@@ -154,21 +502,23 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findMoveMinMax(gs, nextMoves, depth - 1, True)
+            score = findMoveMinMax(gs, nextMoves, depth - 1, True, context, rootDepth)
             if score < minScore:
                 minScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                if depth == rootDepth:
+                    context.bestMove = move
             gs.undoMove()
         return minScore
 
 
-def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
+def findMoveNegaMax(gs, validMoves, depth, turnMultiplier, context, rootDepth=None):
     """
     combine min max , find score and negate it if it is black to move
+    rootDepth is the depth of the first call, where the best move is kept in context.bestMove
     """
-    global nextMove, counter
-    counter += 1
+    if rootDepth is None:
+        rootDepth = depth
+    context.nodes += 1
     if depth == 0:
         return turnMultiplier * scoreBoard(gs)
 
@@ -176,47 +526,220 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     for move in validMoves:
         gs.makeMove(move)
         nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMax(gs, nextMoves, depth - 1, -turnMultiplier)
+        score = -findMoveNegaMax(gs, nextMoves, depth - 1, -turnMultiplier, context, rootDepth)
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
-                nextMove = move
+            if depth == rootDepth:
+                context.bestMove = move
         # score = max(score, maxScore)
         gs.undoMove()
     return maxScore
 
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
+def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier, context):
     """
     combine min max , find score and negate it if it is black to move
+    validMoves is only passed at the root, every other node generates its moves lazily while it searches them
     """
-    global nextMove, counter
-    counter += 1
+    context.nodes += 1
+    if context.nodes % LIMIT_CHECK_INTERVAL == 0:
+        context.checkLimits()
     if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-
-    # move ordering - implement later
+        context.nodes -= 1  # counted again by the quiescence search
+        return quiescenceSearch(gs, alpha, beta, turnMultiplier, context)
+    rootDepth = context.rootDepth
+    ply = rootDepth - depth
+    # positions in the endgame tables are scored exactly, except at the root which has to set the best move. Every
+    # table has a lone king, which rules out almost every other position without a call.
+    if depth != rootDepth and not (gs.materialScore["w"] and gs.materialScore["b"]):
+        score = probeTablebases(gs, ply)
+        if score is not None:
+            return score
+
+    # a stored result that is at least as deep narrows the window or cuts off, but never at the root because the root
+    # has to set the best move
+    alphaOriginal = alpha
+    hashMoveID = NO_MOVE
+    entry = transpositionTable.probe(gs.zobristKey)
+    if entry is not None:
+        entryDepth, entryScore, entryBound, hashMoveID = entry
+        entryScore = scoreFromTable(entryScore, ply)
+        if entryDepth >= depth and depth != rootDepth:
+            if entryBound == EXACT:
+                return entryScore
+            elif entryBound == LOWER_BOUND:
+                alpha = max(alpha, entryScore)
+            else:
+                beta = min(beta, entryScore)
+            if alpha >= beta:
+                return entryScore
+
+    if validMoves is not None:
+        inCheck = gs.inCheck
+        moves = moveOrderer.orderMoves(validMoves, ply, hashMoveID)
+    else:
+        pinsAndChecks = gs.checkForPinsAndChecks()
+        inCheck = pinsAndChecks[0]
+        moves = moveOrderer.orderedMoves(gs, pinsAndChecks, ply, hashMoveID)
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMoveID = NO_MOVE
+    movesSearched = 0
+    for move in moves:
         gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
         # alpha is our max and -beta is opponent max, beta is our min and -alpha is our opponent min
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
+        score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, context)
+        # the first move is kept even if it gets mated, so a node with only losing moves is not taken for stalemate
+        if score > maxScore or bestMoveID == NO_MOVE:
             maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-                print(move, score)
+            bestMoveID = move.moveID
+            if depth == rootDepth:
+                context.bestMove = move
+                if verbose:
+                    print(move, score)
         # score = max(score, maxScore)
         gs.undoMove()
 
         if maxScore > alpha:  # pruning happens
             alpha = maxScore
         if alpha >= beta:
+            moveOrderer.recordCutoff(move, ply, depth, movesSearched)
             break
+        movesSearched += 1
+
+    if bestMoveID == NO_MOVE:  # no legal move, checkmate or stalemate
+        return -(CHECKMATE - ply) if inCheck else STALEMATE
+    if maxScore <= alphaOriginal:
+        bound = UPPER_BOUND
+    elif maxScore >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    transpositionTable.store(gs.zobristKey, depth, scoreToTable(maxScore, ply), bound, bestMoveID)
     return maxScore
 
 
+def isMateScore(score):
+    """
+    True for the score of a mate found by the search or in the endgame tables, for either side
+    """
+    return abs(score) > CHECKMATE - MAX_PLY
+
+
+def scoreToTable(score, ply):
+    """
+    A mate score counts the plies from the root, the transposition table keeps it counted from the position itself so
+    it stays right when the position is reached at another ply
+    """
+    if score > CHECKMATE - MAX_PLY:
+        return score + ply
+    if score < -(CHECKMATE - MAX_PLY):
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    """
+    Inverse of scoreToTable for a position ply plies from the root
+    """
+    if score > CHECKMATE - MAX_PLY:
+        return score - ply
+    if score < -(CHECKMATE - MAX_PLY):
+        return score + ply
+    return score
+
+
+def quiescenceSearch(gs, alpha, beta, turnMultiplier, context, quiescencePly=0):
+    """
+    Search only captures and promotions until the position is quiet, so the board is never scored in the middle of
+    an exchange. The side to move can always stand pat and take the static score, unless it is in check.
+    """
+    context.nodes += 1
+    if context.nodes % LIMIT_CHECK_INTERVAL == 0:
+        context.checkLimits()
+
+    pinsAndChecks = gs.checkForPinsAndChecks()
+    # every evasion has to be looked at when in check, standing pat is not an option, but only for a few plies so a
+    # series of checks can't go on forever
+    searchEvasions = pinsAndChecks[0] and quiescencePly < QUIESCENCE_CHECK_PLIES
+    if searchEvasions:
+        maxScore = -(CHECKMATE - context.rootDepth - quiescencePly)  # mated here unless an evasion is found
+    else:
+        standPat = turnMultiplier * evaluateBoard(gs)
+        if standPat >= beta:
+            return standPat
+        alpha = max(alpha, standPat)
+        maxScore = standPat
+
+    for move in moveOrderer.orderedMoves(gs, pinsAndChecks, MAX_PLY, capturesOnly=not searchEvasions):
+        if not searchEvasions and move.isCapture and not move.pawnPromotion:
+            # delta pruning: even winning the piece for free would not bring the score up to alpha
+            if standPat + gs.pieceScore[move.pieceCaptured[1]] + DELTA_MARGIN <= alpha:
+                continue
+            # taking a piece worth at least as much as the attacker can't lose material, the rest is checked by SEE
+            if USE_SEE_PRUNING and seeScore[move.pieceMoved[1]] > seeScore[move.pieceCaptured[1]] and \
+                    staticExchangeEvaluation(gs, move) < 0:
+                continue
+        gs.makeMove(move)
+        score = -quiescenceSearch(gs, -beta, -alpha, -turnMultiplier, context, quiescencePly + 1)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+    return maxScore
+
+
+def staticExchangeEvaluation(gs, move):
+    """
+    Material won or lost (in pieceScore units) by the capture once all the recaptures on the square are played out,
+    both sides recapture with their least valuable piece and may stop when carrying on does not pay
+    """
+    victimValue = seeScore[move.pieceCaptured[1]]
+    attackerValue = seeScore[move.promotionPiece if move.pawnPromotion else move.pieceMoved[1]]
+    removed = {(move.startRow, move.startCol)}
+    if move.enPassant:
+        removed.add((move.startRow, move.endCol))
+    gains = [victimValue]
+    color = "b" if move.pieceMoved[0] == "w" else "w"
+    while True:
+        attacker = getLeastValuableAttacker(gs, move.endRow, move.endCol, color, removed)
+        if attacker is None:
+            break
+        # the gain so far if the piece standing on the square is taken now
+        gains.append(attackerValue - gains[-1])
+        attackerValue = seeScore[attacker[2][1]]
+        removed.add((attacker[0], attacker[1]))
+        color = "b" if color == "w" else "w"
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
+
+
+def getLeastValuableAttacker(gs, r, c, color, removed):
+    """
+    Returns (row, col, piece) of the cheapest piece of color attacking r, c or None, pieces on the removed squares are
+    treated as gone so sliders behind them join in
+    """
+    attackers = gs.squareAttackers(r, c, color, removed)
+    if not attackers:
+        return None
+    attackerRow, attackerCol = min(attackers, key=lambda square: seeScore[gs.board[square[0]][square[1]][1]])
+    return attackerRow, attackerCol, gs.board[attackerRow][attackerCol]
+
+
+def evaluateBoard(gs):
+    """
+    Same score as scoreBoard, but read from the running scores GameState keeps instead of scanning the board
+    """
+    if gs.checkmate:
+        return -CHECKMATE if gs.whiteToMove else CHECKMATE
+    elif gs.stalemate:
+        return STALEMATE
+    return gs.materialScore["w"] - gs.materialScore["b"] + (gs.positionScore["w"] - gs.positionScore["b"]) * .1
+
+
 def scoreBoard(gs):
     """
     A positive score is good for white, a negative score is good for black
@@ -0,0 +1,539 @@
+"""
+Endgame tablebases for king and one or two pieces against a lone king: KQK, KRK, KPK and KBNK. A table holds one byte
+for every position, the distance to mate in plies + 1 (the side to move wins if that distance is odd and gets mated if
+it is even) or 0 for a draw. The byte of a position is found by its index: the side to move, the slot of the white
+king and a base 64 digit for the square of every other piece. That index is quick to work out but has gaps, the bytes
+of impossible placements (two pieces on one square, kings next to each other, a pawn on the first or last rank) are
+written but never read. A table is just the byte array written to disk and it is probed through mmap without being
+read in.
+
+Only positions with the strong side as white are stored, the others are probed with the board mirrored. Without pawns
+the white king is moved into the a1-d1-d4 triangle by one of the 8 symmetries of the board, with a pawn only the
+mirror between the a and h files can be used.
+
+The tables are generated offline by retrograde analysis: all mates are found first, then every won position is found
+by taking moves back from the positions found one ply earlier, so the tables are built in order of the distance to
+mate. The positions of every ply are split over a pool of processes.
+
+Usage (from the chess folder):
+    python Tablebase.py [--processes N] [--directory DIR] [--verify N] [TABLE ...]
+generates the tables (all of them by default) into the tablebases folder, where the engine looks for them
+"""
+
+import argparse
+import itertools
+import mmap
+import os
+import random
+import time
+from array import array
+from multiprocessing import Pool
+
+from AttackTables import BISHOP_DIRECTIONS, KING_SQUARES, KNIGHT_SQUARES, RAY_SQUARES, ROOK_DIRECTIONS
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+# table name -> the pieces of the strong side next to its king, in the order they are indexed
+TABLES = {"KQK": "Q", "KRK": "R", "KBNK": "BN", "KPK": "P"}
+GENERATION_ORDER = ("KQK", "KRK", "KBNK", "KPK")  # KPK looks up its promotions in KQK and KRK
+PIECE_ORDER = "QRBNP"  # order of the pieces in the table names
+DRAW = 0
+UNDECIDED = 255  # move count of a position that can't be lost any more, it is never counted down to 0
+WHITE, BLACK = 0, 1  # side to move in the position index
+
+# square numbers are row * 8 + col like everywhere else, white pawns move towards row 0
+KING_TARGETS = [tuple(r * 8 + c for r, c in squares) for squares in KING_SQUARES]
+KNIGHT_TARGETS = [tuple(r * 8 + c for r, c in squares) for squares in KNIGHT_SQUARES]
+KING_MASKS = [sum(1 << sq for sq in squares) for squares in KING_TARGETS]
+KNIGHT_MASKS = [sum(1 << sq for sq in squares) for squares in KNIGHT_TARGETS]
+WHITE_PAWN_MASKS = [sum(1 << (sq + offset) for offset, edgeCol in ((-9, 0), (-7, 7)) if sq % 8 != edgeCol)
+                    if sq >= 8 else 0 for sq in range(64)]
+RAYS = [[tuple(r * 8 + c for r, c in RAY_SQUARES[sq][d]) for d in range(8)] for sq in range(64)]
+PIECE_DIRECTIONS = {"Q": ROOK_DIRECTIONS + BISHOP_DIRECTIONS, "R": ROOK_DIRECTIONS, "B": BISHOP_DIRECTIONS}
+
+
+def _betweenMasks(directions):
+    """
+    For every pair of squares (index a * 64 + b) the squares strictly between them if a slider moving in one of the
+    directions gets from a to b, -1 if it can't
+    """
+    masks = [-1] * 4096
+    for a in range(64):
+        for d in directions:
+            between = 0
+            for b in RAYS[a][d]:
+                masks[a * 64 + b] = between
+                between |= 1 << b
+    return masks
+
+
+ROOK_BETWEEN = _betweenMasks(ROOK_DIRECTIONS)
+BISHOP_BETWEEN = _betweenMasks(BISHOP_DIRECTIONS)
+
+# the 8 symmetries of the board, and the a1-d1-d4 triangle the white king is moved into when there are no pawns
+TRANSFORMS = [[(tr * 8 + tc) for r in range(8) for c in range(8)
+               for tr, tc in [((r, c), (r, 7 - c), (7 - r, c), (7 - r, 7 - c),
+                               (c, r), (c, 7 - r), (7 - c, r), (7 - c, 7 - r))[t]]] for t in range(8)]
+TRIANGLE = [sq for sq in range(64) if sq % 8 <= 3 and 7 - sq // 8 <= sq % 8]
+# the symmetries that bring the white king into the triangle (two for the squares on the diagonal) or onto files a-d
+PAWNLESS_TRANSFORMS = [tuple(t for t in range(8) if TRANSFORMS[t][sq] in TRIANGLE) for sq in range(64)]
+PAWN_TRANSFORMS = [(0,) if sq % 8 <= 3 else (1,) for sq in range(64)]
+PAWNLESS_SLOTS = {sq: slot for slot, sq in enumerate(TRIANGLE)}
+PAWN_SLOTS = {sq: sq // 8 * 4 + sq % 8 for sq in range(64) if sq % 8 <= 3}
+
+
+class TableLayout:
+    """
+    Position index of a table: side to move, white king slot, black king and the pieces, each square a base 64 digit
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.pieces = TABLES[name]
+        self.hasPawn = "P" in self.pieces
+        self.transforms = PAWN_TRANSFORMS if self.hasPawn else PAWNLESS_TRANSFORMS
+        self.slots = PAWN_SLOTS if self.hasPawn else PAWNLESS_SLOTS
+        self.kingSquares = sorted(self.slots, key=self.slots.get)  # white king square of every slot
+        self.slotSize = 64 ** (len(self.pieces) + 1)
+        self.size = 2 * len(self.slots) * self.slotSize
+
+    def index(self, sideToMove, whiteKing, blackKing, squares):
+        """
+        Index of the position, the board is turned so the white king is in the part of the board that is stored. When
+        two symmetries do that the smaller index is taken, so every position has exactly one index.
+        """
+        best = None
+        for t in self.transforms[whiteKing]:
+            transform = TRANSFORMS[t]
+            index = (sideToMove * len(self.slots) + self.slots[transform[whiteKing]]) * 64 + transform[blackKing]
+            for sq in squares:
+                index = index * 64 + transform[sq]
+            if best is None or index < best:
+                best = index
+        return best
+
+    def position(self, index):
+        """
+        (side to move, white king, black king, piece squares) of an index
+        """
+        squares = []
+        for _ in self.pieces:
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        index, blackKing = divmod(index, 64)
+        sideToMove, slot = divmod(index, len(self.slots))
+        return sideToMove, self.kingSquares[slot], blackKing, tuple(reversed(squares))
+
+
+def attackedByWhite(sq, whiteKing, pieces, squares, occupancy):
+    """
+    Determine if a white piece attacks sq, pieces on a negative square have been captured
+    """
+    if KING_MASKS[whiteKing] >> sq & 1:
+        return True
+    for piece, pieceSq in zip(pieces, squares):
+        if pieceSq < 0:
+            continue
+        if piece == "N":
+            if KNIGHT_MASKS[pieceSq] >> sq & 1:
+                return True
+        elif piece == "P":
+            if WHITE_PAWN_MASKS[pieceSq] >> sq & 1:
+                return True
+        else:
+            if piece != "B":
+                between = ROOK_BETWEEN[pieceSq * 64 + sq]
+                if between >= 0 and not between & occupancy:
+                    return True
+            if piece != "R":
+                between = BISHOP_BETWEEN[pieceSq * 64 + sq]
+                if between >= 0 and not between & occupancy:
+                    return True
+    return False
+
+
+def blackMoveCount(layout, whiteKing, blackKing, squares):
+    """
+    (number of black king moves, True if one of them captures a piece and so draws). Moves to two mirrored copies of
+    the same position are counted once, like the positions are stored.
+    """
+    pieces = layout.pieces
+    occupancy = 1 << whiteKing  # the black king is not in the way of the squares it moves to
+    for sq in squares:
+        occupancy |= 1 << sq
+    targets = []
+    for target in KING_TARGETS[blackKing]:
+        if KING_MASKS[whiteKing] >> target & 1 or target == whiteKing:
+            continue
+        if occupancy >> target & 1:  # a capture leaves a lone piece at most, a draw if the piece is not defended
+            remaining = tuple(-1 if sq == target else sq for sq in squares)
+            if not attackedByWhite(target, whiteKing, pieces, remaining, occupancy & ~(1 << target)):
+                return 0, True
+        elif not attackedByWhite(target, whiteKing, pieces, squares, occupancy):
+            targets.append(target)
+    transforms = layout.transforms[whiteKing]
+    if len(transforms) == 2 and all(TRANSFORMS[transforms[1]][sq] == TRANSFORMS[transforms[0]][sq] for sq in squares):
+        # the white pieces all stand on the diagonal the board is mirrored at, two king moves can reach one position
+        return len({layout.index(WHITE, whiteKing, target, squares) for target in targets}), False
+    return len(targets), False
+
+
+def initialChunk(args):
+    """
+    Set up the positions of one side to move and white king slot: black positions get their move count and are lost
+    in 0 plies if checkmated, white positions that promote get the value of the promotion from the other tables.
+    Returns (values, counts, [(plies, index) of the positions decided so far]).
+    """
+    name, sideToMove, slot, directory = args
+    layout = TableLayout(name)
+    promotionTables = Tablebases(directory) if layout.hasPawn else None
+    pieces = layout.pieces
+    whiteKing = layout.kingSquares[slot]
+    values = bytearray(layout.slotSize)
+    counts = bytearray([UNDECIDED]) * layout.slotSize
+    decided = []
+    base = (sideToMove * len(layout.slots) + slot) * layout.slotSize
+    offset = 0
+    for blackKing in range(64):
+        for squares in itertools.product(range(64), repeat=len(pieces)):
+            offset += 1
+            if not isLegal(layout, whiteKing, blackKing, squares) or \
+                    layout.index(sideToMove, whiteKing, blackKing, squares) != base + offset - 1:
+                continue  # impossible, or stored under the index of a mirrored copy
+            occupancy = 1 << whiteKing | 1 << blackKing
+            for sq in squares:
+                occupancy |= 1 << sq
+            inCheck = attackedByWhite(blackKing, whiteKing, pieces, squares, occupancy)
+            if sideToMove == BLACK:
+                count, capture = blackMoveCount(layout, whiteKing, blackKing, squares)
+                if not capture and count > 0:
+                    counts[offset - 1] = count
+                elif not capture and inCheck:
+                    values[offset - 1] = 1  # checkmate
+                    decided.append((0, base + offset - 1))
+            elif not inCheck and promotionTables:
+                plies = promotionPlies(whiteKing, blackKing, squares[0], promotionTables)
+                if plies is not None:
+                    decided.append((plies, base + offset - 1))
+    if promotionTables:
+        promotionTables.close()
+    return values, counts, decided
+
+
+def isLegal(layout, whiteKing, blackKing, squares):
+    """
+    Determine if the pieces stand on different squares, the kings apart and pawns off the back rows
+    """
+    if whiteKing == blackKing:
+        return False
+    occupied = {whiteKing, blackKing}
+    for sq in squares:
+        if sq in occupied:
+            return False
+        occupied.add(sq)
+    if layout.hasPawn and not 8 <= squares[-1] < 56:  # no pawns on the back rows
+        return False
+    return not KING_MASKS[whiteKing] >> blackKing & 1
+
+
+def promotionPlies(whiteKing, blackKing, pawn, promotionTables):
+    """
+    Plies to mate after the best promotion of the pawn, None if no promotion wins
+    """
+    if pawn >= 16 or pawn - 8 in (whiteKing, blackKing):
+        return None
+    best = None
+    for table in (promotionTables.tables["KQK"], promotionTables.tables["KRK"]):
+        value = table.map[table.layout.index(BLACK, whiteKing, blackKing, (pawn - 8,))]
+        if value != DRAW and (value - 1) % 2 == 0:  # black to move is mated
+            if best is None or value < best:
+                best = value
+    return best  # value - 1 plies after the promotion, value plies from here
+
+
+def predecessors(args):
+    """
+    The indices of the positions one ply before the given ones: white moves taken back from black to move positions
+    (sideToMove BLACK) or black king moves taken back from white to move positions. Each predecessor is listed once for
+    every position it leads to, as black moves are counted.
+    """
+    name, sideToMove, indexBytes = args
+    layout = TableLayout(name)
+    pieces = layout.pieces
+    indices = array("q")
+    indices.frombytes(indexBytes)
+    result = array("q")
+    for index in indices:
+        _, whiteKing, blackKing, squares = layout.position(index)
+        occupancy = 1 << whiteKing | 1 << blackKing
+        for sq in squares:
+            occupancy |= 1 << sq
+        sources = set()
+        if sideToMove == WHITE:
+            for source in KING_TARGETS[blackKing]:
+                if not occupancy >> source & 1 and not KING_MASKS[whiteKing] >> source & 1:
+                    sources.add(layout.index(BLACK, whiteKing, source, squares))
+            result.extend(sources)
+            continue
+        for source in KING_TARGETS[whiteKing]:
+            if not occupancy >> source & 1 and not KING_MASKS[blackKing] >> source & 1:
+                sourceOccupancy = occupancy ^ (1 << whiteKing) ^ (1 << source)
+                if not attackedByWhite(blackKing, source, pieces, squares, sourceOccupancy):
+                    sources.add(layout.index(WHITE, source, blackKing, squares))
+        for i, (piece, sq) in enumerate(zip(pieces, squares)):
+            for source in pieceSources(piece, sq, occupancy):
+                sourceSquares = squares[:i] + (source,) + squares[i + 1:]
+                sourceOccupancy = occupancy ^ (1 << sq) ^ (1 << source)
+                if not attackedByWhite(blackKing, whiteKing, pieces, sourceSquares, sourceOccupancy):
+                    sources.add(layout.index(WHITE, whiteKing, blackKing, sourceSquares))
+        result.extend(sources)
+    return result.tobytes()
+
+
+def pieceSources(piece, sq, occupancy):
+    """
+    The empty squares the piece on sq can have come from
+    """
+    if piece == "N":
+        return [source for source in KNIGHT_TARGETS[sq] if not occupancy >> source & 1]
+    if piece == "P":  # the pawn stepped forward (towards row 0) once, or twice from row 6
+        sources = []
+        if sq + 8 < 56 and not occupancy >> (sq + 8) & 1:
+            sources.append(sq + 8)
+            if sq // 8 == 4 and not occupancy >> (sq + 16) & 1:
+                sources.append(sq + 16)
+        return sources
+    sources = []
+    for d in PIECE_DIRECTIONS[piece]:
+        for source in RAYS[sq][d]:
+            if occupancy >> source & 1:
+                break
+            sources.append(source)
+    return sources
+
+
+def generate(name, pool, processes, directory):
+    """
+    Build the table by retrograde analysis, returns the table as a bytearray. KPK needs KQK and KRK in directory.
+    """
+    layout = TableLayout(name)
+    if layout.hasPawn and not all(os.path.exists(os.path.join(directory, promoted + ".bin"))
+                                  for promoted in ("KQK", "KRK")):
+        raise FileNotFoundError("%s needs the KQK and KRK tables in %s" % (name, directory))
+    values = bytearray(layout.size)
+    counts = bytearray(layout.size)
+    decided = {}  # plies -> indices found to be decided in that many plies by the setup
+    chunks = [(name, sideToMove, slot, directory) for sideToMove in (WHITE, BLACK)
+              for slot in range(len(layout.slots))]
+    for (_, sideToMove, slot, _), (chunkValues, chunkCounts, chunkDecided) in \
+            zip(chunks, pool.imap(initialChunk, chunks)):
+        start = (sideToMove * len(layout.slots) + slot) * layout.slotSize
+        values[start:start + layout.slotSize] = chunkValues
+        counts[start:start + layout.slotSize] = chunkCounts
+        for plies, index in chunkDecided:
+            decided.setdefault(plies, []).append(index)
+
+    frontier = array("q")  # the positions decided in exactly plies plies
+    plies = 0
+    while True:
+        for index in decided.pop(plies, ()):
+            if plies == 0 or not values[index]:
+                values[index] = plies + 1
+                frontier.append(index)
+        if not frontier and not decided:
+            break
+        # a position lost in plies plies makes every move to it a win in plies + 1, and a position is lost in
+        # plies + 1 once all its moves lead to positions won in plies or less
+        sideToMove = BLACK if plies % 2 == 0 else WHITE
+        chunkSize = max(1, len(frontier) // (processes * 4) + 1)
+        jobs = [(name, sideToMove, frontier[i:i + chunkSize].tobytes()) for i in range(0, len(frontier), chunkSize)]
+        frontier = array("q")
+        value = plies + 2
+        for resultBytes in pool.imap_unordered(predecessors, jobs):
+            result = array("q")
+            result.frombytes(resultBytes)
+            if sideToMove == BLACK:
+                for index in result:
+                    if not values[index]:
+                        values[index] = value
+                        frontier.append(index)
+            else:
+                for index in result:
+                    count = counts[index]
+                    if count != UNDECIDED and not values[index]:
+                        counts[index] = count - 1
+                        if count == 1:
+                            values[index] = value
+                            frontier.append(index)
+        plies += 1
+    return values
+
+
+class Tablebase:
+    """
+    One table mapped from disk
+    """
+
+    def __init__(self, path, name):
+        self.layout = TableLayout(name)
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) != self.layout.size:
+            self.map.close()
+            raise ValueError("%s has %d bytes instead of %d" % (path, len(self.map), self.layout.size))
+
+    def close(self):
+        self.map.close()
+
+
+class Tablebases:
+    """
+    The tables found in a directory, probed with a GameState
+    """
+
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.tables = {}
+        for name in TABLES:
+            path = os.path.join(directory, name + ".bin")
+            if os.path.exists(path):
+                self.tables[name] = Tablebase(path, name)
+        # material (GameState.materialScore) of the strong side of every table with the piece values of pieceScore,
+        # to skip the board scan of positions that no table has
+        self.pieceScore = None
+        self.materials = set()
+
+    def probe(self, gs):
+        """
+        (result, plies) for the side to move: result 1 if it mates in plies plies, -1 if it gets mated in plies plies
+        and 0 for a draw. None if there is no table for the position.
+        """
+        if not self.tables or gs.castlingRights:
+            return None
+        whiteMaterial, blackMaterial = gs.materialScore["w"], gs.materialScore["b"]
+        if whiteMaterial and blackMaterial:
+            return None  # every table has a lone king
+        if not whiteMaterial and not blackMaterial:
+            return 0, 0  # two kings
+        if gs.pieceScore is not self.pieceScore:  # a game state with an evaluation of its own
+            self.pieceScore = gs.pieceScore
+            self.materials = {sum(gs.pieceScore[piece if piece != "P" else "p"] for piece in TABLES[name])
+                              for name in self.tables}
+        if whiteMaterial + blackMaterial not in self.materials:
+            return None
+        pieces = {"w": [], "b": []}
+        kings = {}
+        for r, row in enumerate(gs.board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    if piece[1] == "K":
+                        kings[piece[0]] = r * 8 + c
+                    else:
+                        pieces[piece[0]].append((PIECE_ORDER.index(piece[1].upper()), r * 8 + c))
+        strong = "w" if pieces["w"] else "b"
+        pieces = sorted(pieces[strong])
+        table = self.tables.get("K" + "".join(PIECE_ORDER[piece] for piece, sq in pieces) + "K")
+        if table is None:
+            return None
+        sideToMove = WHITE if gs.whiteToMove else BLACK
+        whiteKing, blackKing, squares = kings["w"], kings["b"], tuple(sq for piece, sq in pieces)
+        if strong == "b":  # mirror the board between the rows and swap the colors
+            sideToMove = 1 - sideToMove
+            whiteKing, blackKing = blackKing ^ 56, whiteKing ^ 56
+            squares = tuple(sq ^ 56 for sq in squares)
+        value = table.map[table.layout.index(sideToMove, whiteKing, blackKing, squares)]
+        if value == DRAW:
+            return 0, 0
+        return (1 if (value - 1) % 2 else -1), value - 1
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+
+def positionFen(sideToMove, whiteKing, blackKing, pieces, squares):
+    board = ["1"] * 64
+    board[whiteKing], board[blackKing] = "K", "k"
+    for piece, sq in zip(pieces, squares):
+        board[sq] = piece
+    rows = "/".join("".join(board[r * 8:r * 8 + 8]) for r in range(8))
+    for length in range(8, 1, -1):
+        rows = rows.replace("1" * length, str(length))
+    return "%s %s - - 0 1" % (rows, "w" if sideToMove == WHITE else "b")
+
+
+def verify(tablebases, samples, rng=random):
+    """
+    Check random positions of every table against the table values after each of their moves, returns the number of
+    positions that don't match
+    """
+    from ChessEngine import GameState
+    errors = 0
+    for name, table in tablebases.tables.items():
+        layout = table.layout
+        checked = 0
+        while checked < samples:
+            sideToMove, whiteKing, blackKing, squares = layout.position(rng.randrange(layout.size))
+            if not isLegal(layout, whiteKing, blackKing, squares) or (sideToMove == WHITE and attackedByWhite(
+                    blackKing, whiteKing, layout.pieces, squares, 1 << whiteKing | sum(1 << sq for sq in squares))):
+                continue
+            checked += 1
+            gs = GameState.from_fen(positionFen(sideToMove, whiteKing, blackKing, layout.pieces, squares))
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                expected = (-1, 0) if gs.inCheck else (0, 0)
+            else:
+                results = []
+                for move in validMoves:
+                    gs.makeMove(move)
+                    result = tablebases.probe(gs)
+                    gs.undoMove()
+                    results.append((0, 0) if result is None else result)  # KBK and KNK after an under-promotion
+                wins = [plies for result, plies in results if result == -1]
+                if wins:
+                    expected = (1, min(wins) + 1)
+                elif any(result == 0 for result, plies in results):
+                    expected = (0, 0)
+                else:
+                    expected = (-1, max(plies for result, plies in results) + 1)
+            if tablebases.probe(gs) != expected:
+                errors += 1
+                print("%s %s: table %s, moves give %s" % (name, gs.to_fen(), tablebases.probe(gs), expected))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the endgame tablebases")
+    parser.add_argument("tables", nargs="*", default=list(GENERATION_ORDER), help="tables to generate (default: all)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes (default: all CPUs)")
+    parser.add_argument("--directory", default=TABLEBASE_DIR, help="where the tables are written")
+    parser.add_argument("--verify", type=int, default=0, metavar="N",
+                        help="check N random positions of every table afterwards")
+    args = parser.parse_args()
+    for name in args.tables:
+        if name not in TABLES:
+            parser.error("unknown table %s, the tables are %s" % (name, ", ".join(GENERATION_ORDER)))
+    if "KPK" in args.tables and not all(name in args.tables or os.path.exists(os.path.join(args.directory, name + ".bin"))
+                                        for name in ("KQK", "KRK")):
+        parser.error("KPK needs the KQK and KRK tables, generate them too")
+    os.makedirs(args.directory, exist_ok=True)
+    with Pool(args.processes) as pool:
+        for name in GENERATION_ORDER:
+            if name not in args.tables:
+                continue
+            start = time.time()
+            values = generate(name, pool, args.processes, args.directory)
+            path = os.path.join(args.directory, name + ".bin")
+            with open(path + ".tmp", "wb") as file:
+                file.write(values)
+            os.replace(path + ".tmp", path)
+            longest = max(values)
+            print("%s: %d bytes, longest mate %d plies, %.1f s" % (name, len(values), longest - 1 if longest else 0,
+                                                                  time.time() - start))
+    if args.verify:
+        tablebases = Tablebases(args.directory)
+        errors = verify(tablebases, args.verify)
+        tablebases.close()
+        print("%d errors" % errors)
+
+
+if __name__ == "__main__":
+    main()
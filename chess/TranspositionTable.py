@@ -0,0 +1,185 @@
+"""
+Fixed size transposition table used by the search to remember positions it has already searched.
+The entries are stored in flat arrays (one per field) sized from a memory budget, so the table never grows and
+the memory it uses is known up front.
+A shared table keeps the same arrays in a multiprocessing.shared_memory block so several search processes can use
+it at once (Lazy SMP). There is no locking: an entry that is replaced while another process reads it is detected by
+reading its key again, and a bad hash move is harmless anyway because the search checks it is legal before using it.
+"""
+
+import os
+from array import array
+from multiprocessing import shared_memory
+
+# bound types of a stored score
+EXACT = 0
+LOWER_BOUND = 1  # the search failed high, the real score is at least this
+UPPER_BOUND = 2  # the search failed low, the real score is at most this
+
+NO_MOVE = 0  # the moveID of a8a8, never a real move
+# bytes per entry: key (8) + score (8) + best move (2) + depth (1) + bound (1) + age (1)
+ENTRY_SIZE = 21
+# array type code and size of every field, in the order they are laid out in a shared block
+FIELDS = (("keys", "Q", 8), ("scores", "d", 8), ("moves", "H", 2), ("depths", "b", 1), ("bounds", "B", 1),
+          ("ages", "B", 1))
+
+
+class TranspositionTable:
+
+    def __init__(self, sizeMB=16, shared=False):
+        self.sharedMemory = None
+        self.ownerPid = None  # the process that created the shared block and has to free it
+        self.views = []
+        self.resize(sizeMB, shared)
+
+    def resize(self, sizeMB, shared=None):
+        """
+        Allocate the table for a memory budget in MB, the number of entries is rounded down to a power of 2 so the
+        slot of a key is just its low bits. This clears the table. shared=None keeps the table shared or not as it is.
+        """
+        if shared is None:
+            shared = self.sharedMemory is not None
+        self.close()
+        entries = max(8, int(sizeMB * 1024 * 1024) // ENTRY_SIZE)
+        entries = 1 << (entries.bit_length() - 1)
+        self.sizeMB = sizeMB
+        self.size = entries
+        self.mask = entries - 1
+        if shared:
+            # a new block is zero filled: all slots empty
+            self.sharedMemory = shared_memory.SharedMemory(create=True, size=entries * ENTRY_SIZE)
+            self.ownerPid = os.getpid()
+            self.attachFields()
+        else:
+            self.keys = array("Q", [0]) * entries
+            self.scores = array("d", [0.0]) * entries
+            self.moves = array("H", [NO_MOVE]) * entries
+            self.depths = array("b", [0]) * entries
+            self.bounds = array("B", [EXACT]) * entries
+            self.ages = array("B", [0]) * entries  # 0 marks an empty slot
+        self.age = 1
+        self.resetStats()
+
+    def attachFields(self):
+        """
+        Point the field arrays at their part of the shared block
+        """
+        buffer = memoryview(self.sharedMemory.buf)
+        self.views = [buffer]
+        offset = 0
+        for name, typeCode, fieldSize in FIELDS:
+            view = buffer[offset:offset + self.size * fieldSize]
+            field = view.cast(typeCode)
+            self.views += [view, field]
+            setattr(self, name, field)
+            offset += self.size * fieldSize
+
+    def close(self):
+        """
+        Detach from the shared block, the process that created it also frees it
+        """
+        if self.sharedMemory is None:
+            return
+        for name, typeCode, fieldSize in FIELDS:
+            delattr(self, name)
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.sharedMemory.close()
+        if self.ownerPid == os.getpid():  # not a forked copy
+            self.sharedMemory.unlink()
+        self.sharedMemory = None
+        self.ownerPid = None
+
+    def __getstate__(self):
+        """
+        A shared table is sent to another process by the name of its block, the arrays are not copied
+        """
+        if self.sharedMemory is None:
+            return self.__dict__
+        return {"sharedName": self.sharedMemory.name, "sizeMB": self.sizeMB, "size": self.size, "age": self.age}
+
+    def __setstate__(self, state):
+        if "sharedName" not in state:
+            self.__dict__.update(state)
+            return
+        self.sizeMB = state["sizeMB"]
+        self.size = state["size"]
+        self.mask = self.size - 1
+        self.age = state["age"]
+        self.sharedMemory = shared_memory.SharedMemory(name=state["sharedName"])
+        self.ownerPid = None
+        self.attachFields()
+        self.resetStats()
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # probes that found the slot taken by another position
+        self.stores = 0
+        self.overwrites = 0  # stores that replaced another position
+
+    def clear(self):
+        if self.sharedMemory is not None:
+            self.ages[:] = bytes(self.size)  # keep the block, other processes are attached to it
+            self.age = 1
+            self.resetStats()
+        else:
+            self.resize(self.sizeMB)
+
+    def newSearch(self):
+        """
+        Called once per move searched, entries from older searches are replaced first
+        """
+        self.age = self.age % 255 + 1
+
+    def probe(self, key):
+        """
+        Returns (depth, score, bound, moveID) stored for the key or None if the position is not in the table
+        """
+        slot = key & self.mask
+        if self.keys[slot] == key and self.ages[slot]:
+            entry = self.depths[slot], self.scores[slot], self.bounds[slot], self.moves[slot]
+            if self.keys[slot] == key:  # not replaced by another process while it was read
+                self.hits += 1
+                return entry
+        self.misses += 1
+        if self.ages[slot]:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, score, bound, moveID=NO_MOVE):
+        """
+        Depth preferred replacement: a slot is kept only if it holds another position from the current search that
+        was searched deeper than this one
+        """
+        slot = key & self.mask
+        storedKey = self.keys[slot]
+        if storedKey != key and self.ages[slot] == self.age and self.depths[slot] > depth:
+            return
+        if storedKey == key and moveID == NO_MOVE:
+            moveID = self.moves[slot]  # keep the best move we already know about
+        elif storedKey != key and self.ages[slot]:
+            self.overwrites += 1
+        # the key is cleared while the entry is written and set last, so a reader never takes a half written entry
+        self.keys[slot] = 0
+        self.scores[slot] = score
+        self.moves[slot] = moveID
+        self.depths[slot] = depth
+        self.bounds[slot] = bound
+        self.ages[slot] = self.age
+        self.keys[slot] = key
+        self.stores += 1
+
+    def hashfull(self):
+        """
+        Permille of the first 1000 slots used by the current search
+        """
+        sample = min(1000, self.size)
+        return sum(1 for slot in range(sample) if self.ages[slot] == self.age) * 1000 // sample
+
+    def stats(self):
+        probes = self.hits + self.misses
+        return "tt hits %d misses %d collisions %d (hit rate %.1f%%) stores %d overwrites %d full %d/1000" % (
+            self.hits, self.misses, self.collisions, 100 * self.hits / probes if probes else 0, self.stores,
+            self.overwrites, self.hashfull())
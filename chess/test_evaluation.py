@@ -0,0 +1,96 @@
+"""
+The running material and position scores of the game states against the reference evaluation that scans the board.
+
+Usage:
+    python -m pytest chess           from the repository root
+    python -m unittest test_evaluation   from the chess folder
+"""
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # the engine modules import each other by file name
+
+from ChessEngine import GameState
+from Evaluation import buildPieceSquareScores, pieceScore, piecePositionScores
+from SmartMoveFinnder import evaluateBoard, scoreBoard
+
+GAMES = 20
+MAX_PLIES = 150
+UNDO_CHANCE = 0.2  # moves taken back at random, the undo has to restore the scores too
+
+
+class IncrementalEvaluationTest(unittest.TestCase):
+
+    def testRandomGames(self):
+        """
+        Play random games and compare evaluateBoard with scoreBoard after every move and undo
+        """
+        rng = random.Random(0)
+        for _ in range(GAMES):
+            gs = GameState()
+            validMoves = gs.getValidMoves()
+            while validMoves and len(gs.moveLog) < MAX_PLIES:
+                gs.makeMove(rng.choice(validMoves))
+                if rng.random() < UNDO_CHANCE:
+                    gs.undoMove()
+                validMoves = gs.getValidMoves()
+                self.assertAlmostEqual(evaluateBoard(gs), scoreBoard(gs), places=9,
+                                       msg="after " + " ".join(str(move) for move in gs.moveLog))
+
+    def testLoadFen(self):
+        """
+        The scores are summed up from the placement of a FEN
+        """
+        fen = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+        gs = GameState(fen)
+        gs.getValidMoves()
+        self.assertAlmostEqual(evaluateBoard(gs), scoreBoard(gs), places=9)
+
+    def testSetEvaluation(self):
+        """
+        A game state with tables of its own keeps its running scores with them
+        """
+        values = dict(pieceScore, Q=9, B=3.25)
+        tables = dict(piecePositionScores, N=[[(r * c) % 5 for c in range(8)] for r in range(8)])
+        rng = random.Random(1)
+        gs = GameState()
+        gs.setEvaluation(values, buildPieceSquareScores(values, tables))
+        validMoves = gs.getValidMoves()
+        while validMoves and len(gs.moveLog) < MAX_PLIES:
+            gs.makeMove(rng.choice(validMoves))
+            if rng.random() < UNDO_CHANCE:
+                gs.undoMove()
+            validMoves = gs.getValidMoves()
+            materialScore, positionScore = gs.computeScores()
+            for color in "wb":
+                self.assertAlmostEqual(gs.materialScore[color], materialScore[color], places=9)
+                self.assertAlmostEqual(gs.positionScore[color], positionScore[color], places=9)
+        self.assertIs(GameState().pieceScore, pieceScore)  # the other game states keep the default tables
+
+    def testSetEvaluationAfterMoves(self):
+        """
+        Moves made before setEvaluation are taken back with the scores of the new tables
+        """
+        values = dict(pieceScore, p=1.5, N=3.5)
+        tables = dict(piecePositionScores, N=[[(r + c) % 3 for c in range(8)] for r in range(8)])
+        rng = random.Random(2)
+        gs = GameState()
+        for _ in range(40):
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                break
+            gs.makeMove(rng.choice(validMoves))
+        gs.setEvaluation(values, buildPieceSquareScores(values, tables))
+        while gs.moveLog:
+            gs.undoMove()
+            materialScore, positionScore = gs.computeScores()
+            for color in "wb":
+                self.assertAlmostEqual(gs.materialScore[color], materialScore[color], places=9)
+                self.assertAlmostEqual(gs.positionScore[color], positionScore[color], places=9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+The alpha-beta search on small positions whose result is known.
+
+Usage:
+    python -m pytest chess           from the repository root
+    python -m unittest test_search   from the chess folder
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # the engine modules import each other by file name
+
+import SmartMoveFinnder
+from ChessEngine import GameState
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        SmartMoveFinnder.verbose = False
+        SmartMoveFinnder.transpositionTable.clear()
+
+    def search(self, fen, depth):
+        gs = GameState(fen)
+        return SmartMoveFinnder.searchPosition(gs, gs.getValidMoves(), maxTime=None, maxDepth=depth, firstDepth=depth)
+
+    def testMatedInOne(self):
+        """
+        Every move of the lone king gets mated, which is a lost position and not a stalemate
+        """
+        for depth in (2, 3):
+            _, iterations = self.search("k7/8/1K6/8/8/8/8/7R b - - 0 1", depth)
+            self.assertEqual(iterations[-1]["score"], -(SmartMoveFinnder.CHECKMATE - 2))  # mated on the second ply
+
+    def testMateInTwo(self):
+        move, iterations = self.search("k7/8/2K5/8/8/8/8/7R w - - 0 1", 4)
+        self.assertIn(move.getChessNotation(), ("c6b6", "c6c7"))  # Rh8 or Ra1 mates next
+        self.assertEqual(iterations[-1]["score"], SmartMoveFinnder.CHECKMATE - 3)  # mate on the third ply
+
+    def testMateScoreThroughTable(self):
+        """
+        A mate found in the transposition table keeps its distance from the root when reached at another ply
+        """
+        self.search("k7/8/2K5/8/8/8/8/7R w - - 0 1", 4)
+        _, iterations = self.search("k7/8/2K5/8/8/8/8/7R w - - 0 1", 5)
+        self.assertEqual(iterations[-1]["score"], SmartMoveFinnder.CHECKMATE - 3)
+
+    def testMateScores(self):
+        for ply in (0, 3, 40):
+            for score in (SmartMoveFinnder.CHECKMATE - 7, -(SmartMoveFinnder.CHECKMATE - 12), 2.5):
+                tableScore = SmartMoveFinnder.scoreToTable(score, ply)
+                self.assertEqual(SmartMoveFinnder.scoreFromTable(tableScore, ply), score)
+                self.assertEqual(SmartMoveFinnder.isMateScore(score), abs(score) > 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
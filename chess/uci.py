@@ -0,0 +1,227 @@
+"""
+Headless UCI front end, so the engine can be run by match tools and GUIs that speak the protocol or as a backend
+without a display. Nothing here imports pygame.
+
+Usage:
+    python -m chess.uci     from the repository root
+    python uci.py           from the chess folder
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # the engine modules import each other by file name
+
+from ChessEngine import GameState, START_FEN
+import SmartMoveFinnder
+
+ENGINE_NAME = "PyChess"
+ENGINE_AUTHOR = "PyChess contributors"
+MAX_HASH_MB = 4096
+MAX_THREADS = 64
+MOVES_TO_GO = 30  # moves the remaining clock time is shared over when the GUI doesn't say
+MOVE_OVERHEAD = 0.05  # seconds kept back from the clock for the communication with the GUI
+GO_INTEGER_PARAMETERS = ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime")
+
+
+class UciEngine:
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()  # the search thread writes info and bestmove lines
+        self.gs = GameState()
+        self.positionValid = True  # False after a position command that could not be set up, go then has no move
+        self.processes = 1
+        self.stopEvent = threading.Event()
+        self.searchThread = None
+        SmartMoveFinnder.verbose = False  # stdout belongs to the protocol
+        SmartMoveFinnder.stopEvent = self.stopEvent
+        SmartMoveFinnder.reportIteration = self.sendInfo
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def handle(self, line):
+        """
+        Process one command line, returns False on quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (SmartMoveFinnder.HASH_SIZE_MB,
+                                                                               MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setOption(arguments)
+        elif command == "ucinewgame":
+            self.stop()
+            SmartMoveFinnder.transpositionTable.clear()
+            SmartMoveFinnder.moveOrderer.newSearch()
+        elif command == "position":
+            self.stop()
+            self.setPosition(arguments)
+        elif command == "go":
+            self.stop()
+            self.go(arguments)
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            SmartMoveFinnder.closeSharedTable()
+            return False
+        return True  # unknown commands are ignored, as the protocol asks
+
+    def setOption(self, arguments):
+        """
+        setoption name <name> value <value>
+        """
+        if "name" not in arguments:
+            return
+        valueIndex = arguments.index("value") if "value" in arguments else len(arguments)
+        name = " ".join(arguments[arguments.index("name") + 1:valueIndex]).lower()
+        value = " ".join(arguments[valueIndex + 1:])
+        try:
+            if name == "hash":
+                self.stop()
+                SmartMoveFinnder.transpositionTable.resize(max(1, min(int(value), MAX_HASH_MB)))
+                SmartMoveFinnder.closeSharedTable()  # made again with the new size by the next parallel search
+            elif name == "threads":
+                self.processes = max(1, min(int(value), MAX_THREADS))
+        except ValueError:
+            self.send("info string invalid value %r for option %s" % (value, name))
+
+    def setPosition(self, arguments):
+        """
+        position startpos | fen <fen> [moves <move> ...]
+        """
+        movesIndex = arguments.index("moves") if "moves" in arguments else len(arguments)
+        if arguments and arguments[0] == "fen":
+            fen = " ".join(arguments[1:movesIndex])
+        else:
+            fen = START_FEN
+        self.positionValid = False
+        try:
+            self.gs.loadFen(fen)
+        except ValueError as error:
+            self.send("info string " + str(error))
+            return
+        for moveText in arguments[movesIndex + 1:]:
+            move = next((move for move in self.gs.getValidMoves() if move.getChessNotation() == moveText), None)
+            if move is None:
+                self.send("info string illegal move %s in %s" % (moveText, self.gs.to_fen()))
+                return
+            self.gs.makeMove(move)
+        self.positionValid = True
+
+    def go(self, arguments):
+        """
+        go [wtime <ms>] [btime <ms>] [winc <ms>] [binc <ms>] [movestogo <n>] [depth <n>] [nodes <n>] [movetime <ms>]
+        [infinite]
+        """
+        if not self.positionValid:
+            self.send("info string no valid position to search")
+            self.send("bestmove 0000")
+            return
+        parameters = {}
+        for i, token in enumerate(arguments):
+            if token in GO_INTEGER_PARAMETERS and i + 1 < len(arguments):
+                try:
+                    parameters[token] = int(arguments[i + 1])
+                except ValueError:
+                    pass
+        infinite = "infinite" in arguments
+        maxTime = None if infinite else self.timeBudget(parameters)
+        maxDepth = parameters.get("depth", SmartMoveFinnder.MAX_DEPTH)
+        maxNodes = parameters.get("nodes")
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.search, args=(maxTime, maxNodes, maxDepth, infinite),
+                                             daemon=True)
+        self.searchThread.start()
+
+    def timeBudget(self, parameters):
+        """
+        Seconds to spend on the move, None when only depth or nodes limit the search
+        """
+        if "movetime" in parameters:
+            return max(0.0, parameters["movetime"] / 1000 - MOVE_OVERHEAD)
+        remaining = parameters.get("wtime" if self.gs.whiteToMove else "btime")
+        if remaining is None:
+            if "depth" in parameters or "nodes" in parameters:
+                return None
+            return SmartMoveFinnder.THINK_TIME  # a bare go
+        increment = parameters.get("winc" if self.gs.whiteToMove else "binc", 0)
+        budget = remaining / parameters.get("movestogo", MOVES_TO_GO) + increment * 3 / 4
+        return max(0.0, min(budget, remaining - increment) / 1000 - MOVE_OVERHEAD)
+
+    def search(self, maxTime, maxNodes, maxDepth, infinite):
+        """
+        Body of the search thread, ends with the bestmove line
+        """
+        validMoves = self.gs.getValidMoves()
+        bestMove = None
+        if not infinite:
+            bestMove = SmartMoveFinnder.findBookMove(self.gs, validMoves)
+            if bestMove is None:
+                bestMove = SmartMoveFinnder.findTablebaseMove(self.gs, validMoves)
+                if bestMove is not None:
+                    self.send("info depth 1 score %s nodes 0 time 0 pv %s" % (
+                        self.scoreText(SmartMoveFinnder.probeTablebases(self.gs)), bestMove.getChessNotation()))
+        if bestMove is None and validMoves:
+            bestMove, iterations = SmartMoveFinnder.parallelSearch(self.gs, validMoves, maxTime, maxNodes, maxDepth,
+                                                                   self.processes)
+        if infinite:
+            self.stopEvent.wait()  # the protocol only allows bestmove after stop
+        self.send("bestmove " + ("0000" if bestMove is None else bestMove.getChessNotation()))
+
+    def sendInfo(self, iteration):
+        """
+        An info line for a completed iteration of the search
+        """
+        self.send("info depth %d score %s nodes %d time %d pv %s" % (
+            iteration["depth"], self.scoreText(iteration["score"]), iteration["nodes"], iteration["time"] * 1000,
+            " ".join(move.getChessNotation() for move in iteration["pv"])))
+
+    @staticmethod
+    def scoreText(score):
+        """
+        The score of an info line: mate in moves, negative when the engine gets mated, or centipawns
+        """
+        if SmartMoveFinnder.isMateScore(score):
+            moves = (SmartMoveFinnder.CHECKMATE - abs(score) + 1) // 2  # a mate score counts the plies to mate
+            return "mate %d" % (moves if score > 0 else -moves)
+        return "cp %d" % round(score * 100)  # the evaluation counts a pawn as 1
+
+    def stop(self):
+        """
+        Stop a running search and wait for its bestmove line
+        """
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+
+def main(commands=None, output=sys.stdout):
+    if commands is None:
+        # a reader of its own: the helper processes of a parallel search close sys.stdin when they start, which would
+        # wait forever for the lock this thread holds while it waits for the next command
+        commands = open(sys.stdin.fileno(), closefd=False)
+    engine = UciEngine(output)
+    for line in commands:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()